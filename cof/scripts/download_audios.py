@@ -8,7 +8,7 @@ Uso:
     python scripts/download_audios.py --dry-run          # só lista sem baixar
 """
 
-import json
+import asyncio
 import re
 import subprocess
 import sys
@@ -19,11 +19,18 @@ from urllib.parse import parse_qs, unquote, urlparse
 import httpx
 
 BASE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE))
+
+from src.auth import get_token  # noqa: E402
+from src.bandwidth import ytdlp_rate_args  # noqa: E402
+from src.config import DATA_DIR  # noqa: E402
+from src.state import SCOPE_AUDIOS, StateStore  # noqa: E402
+
 YTDLP = str(BASE / ".venv" / "bin" / "yt-dlp")
-TOKEN_FILE = BASE / "data" / "token.json"
 
-ORIG_DIR = BASE / "data" / "COF Original" / "audios"
-REMASTER_DIR = BASE / "data" / "COF Remasterizado" / "audios"
+# Em DATA_DIR (COF_DATA_DIR), junto do estado
+ORIG_DIR = DATA_DIR / "COF Original" / "audios"
+REMASTER_DIR = DATA_DIR / "COF Remasterizado" / "audios"
 
 API_BASE = "https://api.seminariodefilosofia.org/v1"
 
@@ -54,8 +61,8 @@ RE_AUAL_SLUG = re.compile(r"aual[_-]0*(\d{1,3})")  # typo: aual-289
 
 
 def load_token() -> str:
-    with open(TOKEN_FILE) as f:
-        return json.load(f)["token"]
+    """Token válido, renovado (uma vez entre todos os processos) se preciso."""
+    return asyncio.run(get_token())
 
 
 def _extract_sc_url(embed_link: str) -> str | None:
@@ -105,20 +112,8 @@ def _extract_aula_num(sc_url: str) -> int | None:
     return None
 
 
-def load_archive(archive_path: Path) -> set[str]:
-    if not archive_path.exists():
-        return set()
-    return {line.strip() for line in archive_path.read_text().splitlines() if line.strip()}
-
-
-def save_archive_entry(archive_path: Path, entry: str) -> None:
-    archive_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(archive_path, "a") as f:
-        f.write(entry + "\n")
-
-
-def download_track(url: str, output_path: Path, archive_path: Path) -> bool:
-    """Baixa uma track com yt-dlp. Retorna True se sucesso."""
+def download_track(url: str, output_path: Path, store: StateStore) -> bool:
+    """Baixa uma track com yt-dlp e registra no estado. Retorna True se sucesso."""
     if output_path.exists():
         return True
 
@@ -129,21 +124,22 @@ def download_track(url: str, output_path: Path, archive_path: Path) -> bool:
         "--no-overwrites",
         "--quiet", "--no-warnings",
         "--progress",
+        *ytdlp_rate_args(),
         url,
     ]
 
+    store.mark_started(url, SCOPE_AUDIOS, output_path)
     result = subprocess.run(cmd)
     if result.returncode == 0 and output_path.exists():
-        save_archive_entry(archive_path, f"soundcloud {url}")
+        store.mark_done(url, SCOPE_AUDIOS, output_path, size=output_path.stat().st_size)
         return True
+    store.mark_failed(url, SCOPE_AUDIOS, f"yt-dlp retornou {result.returncode}")
     return False
 
 
-def download_original(dry_run: bool = False):
+def download_original(store: StateStore, dry_run: bool = False):
     print("=== COF Original: 6 playlists ===")
     ORIG_DIR.mkdir(parents=True, exist_ok=True)
-    archive = ORIG_DIR / ".archive.txt"
-    archived = load_archive(archive)
 
     # Fase 1: coletar todas as tracks de todas as playlists com dedup
     all_tracks: dict[int, tuple[int, str]] = {}  # aula_num -> (playlist_idx, track_url)
@@ -193,7 +189,7 @@ def download_original(dry_run: bool = False):
             continue
 
         print(f"  Baixando Aula_{aula_num:03d}.mp3 ...", end=" ", flush=True)
-        if download_track(track_url, dest, archive):
+        if download_track(track_url, dest, store):
             total_ok += 1
             print("OK")
         else:
@@ -205,11 +201,9 @@ def download_original(dry_run: bool = False):
         print(f"\nOriginal: {total_ok} baixados, {total_skip} já existiam, {total_fail} falhas")
 
 
-def download_remasterizado(dry_run: bool = False):
+def download_remasterizado(store: StateStore, dry_run: bool = False):
     print("\n=== COF Remasterizado ===")
     REMASTER_DIR.mkdir(parents=True, exist_ok=True)
-    archive = REMASTER_DIR / ".archive.txt"
-    archived = load_archive(archive)
 
     token = load_token()
     headers = {"Authorization": f"JWT {token}"}
@@ -252,7 +246,7 @@ def download_remasterizado(dry_run: bool = False):
             continue
 
         print(f"  Baixando {safe_name}.mp3 ...", end=" ", flush=True)
-        if download_track(track["url"], dest, archive):
+        if download_track(track["url"], dest, store):
             total_ok += 1
             print("OK")
         else:
@@ -272,10 +266,11 @@ def main():
     if dry_run:
         print("=== MODO DRY-RUN ===\n")
 
-    if do_original:
-        download_original(dry_run)
-    if do_remaster:
-        download_remasterizado(dry_run)
+    with StateStore() as store:
+        if do_original:
+            download_original(store, dry_run)
+        if do_remaster:
+            download_remasterizado(store, dry_run)
 
 
 if __name__ == "__main__":
@@ -2,7 +2,6 @@
 """Download de cursos extracurriculares do Seminário de Filosofia."""
 
 import asyncio
-import json
 import re
 import subprocess
 import sys
@@ -15,11 +14,17 @@ import httpx
 
 # --- Configuração ---
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
-DATA_DIR = PROJECT_ROOT / "data"
-TOKEN_FILE = DATA_DIR / "token.json"
-EXTRA_DIR = DATA_DIR / "extracurriculares"
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src import downloader  # noqa: E402
+from src.auth import TokenManager  # noqa: E402
+from src.bandwidth import ytdlp_rate_args  # noqa: E402
+from src.config import DISCOVERY_CONCURRENCY, EXTRA_DIR  # noqa: E402
+from src.scraper import fetch_paginated  # noqa: E402
+from src.session import Session  # noqa: E402
+from src.state import SCOPE_EXTRA, StateStore  # noqa: E402
+
 INVENTARIO_FILE = EXTRA_DIR / "INVENTÁRIO.md"
-DOWNLOADED_STATE_FILE = EXTRA_DIR / "downloaded.json"
 
 API_BASE = "https://api.seminariodefilosofia.org/v1"
 CURSOS_REGULARES = {1, 30}  # COF Original e COF Remasterizado
@@ -71,52 +76,55 @@ def sanitize_dirname(name: str) -> str:
 
 
 async def fetch_all_pages(client: httpx.AsyncClient, url: str) -> list[dict]:
-    """Busca todas as páginas de um endpoint paginado."""
-    results = []
-    params = {"limit": 100, "offset": 0}
-    while True:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        data = r.json()
-        page = data.get("results", [])
-        results.extend(page)
-        if not data.get("next"):
-            break
-        params["offset"] += 100
-    return results
-
-
-async def discover_courses(token: str) -> list[CourseInfo]:
-    """Retorna todos os cursos extracurriculares com seus sources."""
-    headers = {"Authorization": f"JWT {token}"}
-    courses: list[CourseInfo] = []
-
-    async with httpx.AsyncClient(headers=headers, follow_redirects=True, timeout=30) as client:
-        raw_courses = await fetch_all_pages(client, f"{API_BASE}/user/courses/")
-
-        for c in raw_courses:
-            if c["id"] in CURSOS_REGULARES:
-                continue
-            info = CourseInfo(id=c["id"], title=c["title"], count_lessons=c["count_lessons"])
-
-            raw_sources = await fetch_all_pages(client, f"{API_BASE}/courses/sources/{c['id']}")
-
-            for s in raw_sources:
-                sc_url = None
-                if s.get("link") and "soundcloud.com" in s.get("link", ""):
-                    sc_url = extract_soundcloud_url(s["link"])
-
-                source = Source(
-                    name=s.get("name", "Sem título"),
-                    course_id=c["id"],
-                    course_name=c["title"],
-                    category_key=s.get("category_key", "outros"),
-                    file_url=s.get("file"),
-                    soundcloud_url=sc_url,
-                )
-                info.sources.append(source)
-
-            courses.append(info)
+    """Busca todas as páginas de um endpoint paginado (em paralelo, via count)."""
+    return await fetch_paginated(client, url, {"limit": 100})
+
+
+async def _course_info(client: httpx.AsyncClient, c: dict) -> CourseInfo:
+    """Busca os sources de um curso."""
+    info = CourseInfo(id=c["id"], title=c["title"], count_lessons=c["count_lessons"])
+
+    raw_sources = await fetch_all_pages(client, f"{API_BASE}/courses/sources/{c['id']}")
+
+    for s in raw_sources:
+        sc_url = None
+        if s.get("link") and "soundcloud.com" in s.get("link", ""):
+            sc_url = extract_soundcloud_url(s["link"])
+
+        source = Source(
+            name=s.get("name", "Sem título"),
+            course_id=c["id"],
+            course_name=c["title"],
+            category_key=s.get("category_key", "outros"),
+            file_url=s.get("file"),
+            soundcloud_url=sc_url,
+        )
+        info.sources.append(source)
+
+    return info
+
+
+async def discover_courses(client: httpx.AsyncClient) -> list[CourseInfo]:
+    """Retorna todos os cursos extracurriculares com seus sources.
+
+    Os cursos são buscados em paralelo (até DISCOVERY_CONCURRENCY por vez);
+    um curso que falha é reportado e omitido, sem afetar os demais.
+    """
+    raw_courses = await fetch_all_pages(client, f"{API_BASE}/user/courses/")
+    semaphore = asyncio.Semaphore(DISCOVERY_CONCURRENCY)
+
+    async def fetch(c: dict) -> CourseInfo | None:
+        async with semaphore:
+            try:
+                return await _course_info(client, c)
+            except Exception as e:
+                print(f"  ERRO ao buscar curso {c['title']} (id={c['id']}): {e}")
+                return None
+
+    results = await asyncio.gather(
+        *(fetch(c) for c in raw_courses if c["id"] not in CURSOS_REGULARES)
+    )
+    courses = [info for info in results if info is not None]
 
     return sorted(courses, key=lambda c: c.id)
 
@@ -177,69 +185,74 @@ def save_inventario(content: str) -> None:
     print(f"Inventário salvo em: {INVENTARIO_FILE}")
 
 
-def load_downloaded() -> set[str]:
-    """Carrega URLs já baixadas do arquivo de estado."""
-    if DOWNLOADED_STATE_FILE.exists():
-        return set(json.loads(DOWNLOADED_STATE_FILE.read_text()))
-    return set()
-
-
-def save_downloaded(downloaded: set[str]) -> None:
-    """Persiste URLs baixadas."""
-    DOWNLOADED_STATE_FILE.write_text(
-        json.dumps(sorted(downloaded), indent=2, ensure_ascii=False),
-        encoding="utf-8"
-    )
-
+async def download_file(
+    client: httpx.AsyncClient,
+    url: str,
+    dest: Path,
+    store: StateStore,
+    limiter: downloader.HostLimiter,
+) -> bool:
+    """Download streaming resumível de um arquivo. Retorna True se bem-sucedido.
 
-async def download_file(client: httpx.AsyncClient, url: str, dest: Path) -> bool:
-    """Download streaming de um arquivo. Retorna True se bem-sucedido."""
+    Usa o mesmo mecanismo do agente principal: grava em .part, retoma com
+    Range e deduplica pelo blob store, de modo que um arquivo idêntico ao de
+    outro curso vira um hardlink em vez de ser baixado de novo.
+    """
     if dest.exists():
         print(f"  [JÁ EXISTE] {dest.name}")
         return True
-    dest.parent.mkdir(parents=True, exist_ok=True)
+    store.mark_started(url, SCOPE_EXTRA, dest)
     try:
-        async with client.stream("GET", url) as resp:
-            resp.raise_for_status()
-            with open(dest, "wb") as f:
-                async for chunk in resp.aiter_bytes(8192):
-                    f.write(chunk)
-        size_mb = dest.stat().st_size / (1024 * 1024)
-        print(f"  [OK] {dest.name} ({size_mb:.1f} MB)")
-        return True
+        result = await downloader.download_file(client, url, dest, limiter, store)
     except Exception as e:
+        # O .part é mantido para ser retomado na próxima execução
+        store.mark_failed(url, SCOPE_EXTRA, str(e))
         print(f"  [ERRO] {dest.name}: {e}")
-        if dest.exists():
-            dest.unlink()
         return False
-
-
-async def download_direct_files(courses: list[CourseInfo], token: str, downloaded: set[str]) -> set[str]:
-    """Baixa todos os arquivos com download direto."""
-    headers = {"Authorization": f"JWT {token}"}
+    store.mark_done(
+        url, SCOPE_EXTRA, dest, size=result.size, sha256=result.sha256,
+        etag=result.etag, last_modified=result.last_modified,
+    )
+    size_mb = result.size / (1024 * 1024)
+    status = "REAPROVEITADO" if result.reused else "OK"
+    print(f"  [{status}] {dest.name} ({size_mb:.1f} MB)")
+    return True
+
+
+async def download_direct_files(
+    client: httpx.AsyncClient,
+    courses: list[CourseInfo],
+    downloaded: set[str],
+    store: StateStore,
+    limiter: downloader.HostLimiter,
+) -> set[str]:
+    """Baixa todos os arquivos com download direto, registrando cada um no estado.
+
+    limiter é o da sessão (Session.limiter): pacing por host e limite global
+    de banda compartilhados com as requisições da API.
+    """
     newly_downloaded = set()
 
-    async with httpx.AsyncClient(headers=headers, follow_redirects=True, timeout=300) as client:
-        for course in courses:
-            direct = [s for s in course.sources if s.file_url and s.file_url not in downloaded]
-            if not direct:
-                continue
-
-            course_dir = EXTRA_DIR / sanitize_dirname(course.title)
-            print(f"\n[{course.title}] — {len(direct)} arquivo(s) para baixar")
-
-            for source in direct:
-                subdir = CATEGORY_TO_DIR.get(source.category_key, "outros")
-                dest_dir = course_dir / subdir
-                fname = re.sub(r'[<>:"/\\|?*]', '_', source.name).strip()
-                if not Path(fname).suffix:
-                    ext = source.file_url.rsplit(".", 1)[-1].split("?")[0]
-                    fname = f"{fname}.{ext}"
-                dest = dest_dir / fname
+    for course in courses:
+        direct = [s for s in course.sources if s.file_url and s.file_url not in downloaded]
+        if not direct:
+            continue
 
-                ok = await download_file(client, source.file_url, dest)
-                if ok:
-                    newly_downloaded.add(source.file_url)
+        course_dir = EXTRA_DIR / sanitize_dirname(course.title)
+        print(f"\n[{course.title}] — {len(direct)} arquivo(s) para baixar")
+
+        for source in direct:
+            subdir = CATEGORY_TO_DIR.get(source.category_key, "outros")
+            dest_dir = course_dir / subdir
+            fname = re.sub(r'[<>:"/\\|?*]', '_', source.name).strip()
+            if not Path(fname).suffix:
+                ext = source.file_url.rsplit(".", 1)[-1].split("?")[0]
+                fname = f"{fname}.{ext}"
+            dest = dest_dir / fname
+
+            ok = await download_file(client, source.file_url, dest, store, limiter)
+            if ok:
+                newly_downloaded.add(source.file_url)
 
     return newly_downloaded
 
@@ -278,6 +291,7 @@ def download_soundcloud_playlist(sc_url: str, dest_dir: Path, course_name: str)
     ]
     if ffmpeg_dir:
         cmd += ["--ffmpeg-location", ffmpeg_dir]
+    cmd += ytdlp_rate_args()
 
     try:
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=3600)
@@ -296,8 +310,10 @@ def download_soundcloud_playlist(sc_url: str, dest_dir: Path, course_name: str)
         return False
 
 
-def download_soundcloud_courses(courses: list[CourseInfo], downloaded: set[str]) -> set[str]:
-    """Baixa playlists SoundCloud de todos os cursos."""
+def download_soundcloud_courses(
+    courses: list[CourseInfo], downloaded: set[str], store: StateStore
+) -> set[str]:
+    """Baixa playlists SoundCloud de todos os cursos, registrando cada uma no estado."""
     newly_downloaded = set()
 
     for course in courses:
@@ -310,23 +326,30 @@ def download_soundcloud_courses(courses: list[CourseInfo], downloaded: set[str])
 
         for source in sc_sources:
             dest_dir = course_dir / "audios"
+            store.mark_started(source.soundcloud_url, SCOPE_EXTRA, dest_dir)
             ok = download_soundcloud_playlist(source.soundcloud_url, dest_dir, course.title)
             if ok:
+                store.mark_done(source.soundcloud_url, SCOPE_EXTRA, dest_dir)
                 newly_downloaded.add(source.soundcloud_url)
+            else:
+                store.mark_failed(source.soundcloud_url, SCOPE_EXTRA, "falha no yt-dlp")
 
     return newly_downloaded
 
 
 async def main_async(dry_run: bool = False, curso_id: int | None = None) -> None:
     """Fluxo principal: descoberta → inventário → download."""
-    if not TOKEN_FILE.exists():
-        print(f"ERRO: Token não encontrado em {TOKEN_FILE}")
-        print("Execute o agente principal primeiro para autenticar.")
-        sys.exit(1)
+    # Token compartilhado com os demais processos via src.token_broker
+    async with Session() as session, TokenManager(session.api) as tokens:
+        await tokens.get()
+        session.set_auth(tokens)
+        await _run(session, dry_run, curso_id)
 
-    token = json.loads(TOKEN_FILE.read_text())["token"]
+
+async def _run(session: Session, dry_run: bool, curso_id: int | None) -> None:
+    """Descoberta, inventário e download usando os clientes da sessão."""
     print("Descobrindo cursos extracurriculares...")
-    courses = await discover_courses(token)
+    courses = await discover_courses(session.api)
 
     if curso_id is not None:
         courses = [c for c in courses if c.id == curso_id]
@@ -336,25 +359,24 @@ async def main_async(dry_run: bool = False, curso_id: int | None = None) -> None
 
     print(f"  {len(courses)} curso(s) encontrado(s)")
 
-    downloaded = load_downloaded()
-
-    inventario = generate_inventario(courses, downloaded)
-    save_inventario(inventario)
+    with StateStore() as store:
+        downloaded = store.done_urls()
 
-    if dry_run:
-        print("\n[DRY RUN] Inventário gerado. Nenhum arquivo baixado.")
-        print(f"Veja: {INVENTARIO_FILE}")
-        return
+        inventario = generate_inventario(courses, downloaded)
+        save_inventario(inventario)
 
-    print("\nBaixando arquivos diretos (PDFs, áudios)...")
-    new_direct = await download_direct_files(courses, token, downloaded)
-    downloaded.update(new_direct)
+        if dry_run:
+            print("\n[DRY RUN] Inventário gerado. Nenhum arquivo baixado.")
+            print(f"Veja: {INVENTARIO_FILE}")
+            return
 
-    print("\nBaixando playlists SoundCloud...")
-    new_sc = download_soundcloud_courses(courses, downloaded)
-    downloaded.update(new_sc)
+        print("\nBaixando arquivos diretos (PDFs, áudios)...")
+        new_direct = await download_direct_files(session.files, courses, downloaded, store, session.limiter)
+        downloaded.update(new_direct)
 
-    save_downloaded(downloaded)
+        print("\nBaixando playlists SoundCloud...")
+        new_sc = download_soundcloud_courses(courses, downloaded, store)
+        downloaded.update(new_sc)
 
     inventario = generate_inventario(courses, downloaded)
     save_inventario(inventario)
@@ -1,49 +1,41 @@
-import json
+import asyncio
 import logging
+import time
 
-from playwright.async_api import async_playwright
+import httpx
 
-from src.config import EMAIL, PASSWORD, LOGIN_URL, COOKIE_FILE, API_BASE
+from src.config import (
+    API_BASE,
+    BROWSER_STATE_FILE,
+    EMAIL,
+    LOGIN_BLOCKED_HOSTS,
+    LOGIN_BLOCKED_RESOURCES,
+    LOGIN_API_TIMEOUT,
+    LOGIN_API_URL,
+    LOGIN_BROWSER_ARGS,
+    LOGIN_TOKEN_FIELDS,
+    LOGIN_URL,
+    PASSWORD,
+    TOKEN_REFRESH_AHEAD,
+)
+from src.token_broker import load_token, refresh_token, token_expiry, token_fresh
 
 logger = logging.getLogger("cof.auth")
 
-# Reutilizamos COOKIE_FILE para armazenar o token (compat com nome existente)
-TOKEN_FILE = COOKIE_FILE.with_name("token.json")
 
-
-def _save_token(token: str) -> None:
-    """Persiste token JWT em disco."""
-    TOKEN_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(TOKEN_FILE, "w") as f:
-        json.dump({"token": token}, f)
-    logger.debug("Token salvo em %s", TOKEN_FILE)
-
-
-def _load_token() -> str | None:
-    """Carrega token JWT do disco, se existir."""
-    if not TOKEN_FILE.exists():
-        return None
-    with open(TOKEN_FILE) as f:
-        data = json.load(f)
-    token = data.get("token")
-    logger.debug("Token carregado de %s", TOKEN_FILE)
-    return token
-
-
-async def _validate_token(token: str) -> bool:
+async def _validate_token(client: httpx.AsyncClient, token: str) -> bool:
     """Verifica se o token JWT ainda é válido via API."""
-    import httpx
-
     headers = {
         "Authorization": f"JWT {token}",
     }
     try:
-        async with httpx.AsyncClient(headers=headers) as client:
-            r = await client.get(
-                f"{API_BASE}/accounts/",
-                timeout=15.0,
-            )
-            valid = r.status_code == 200
+        r = await client.get(
+            f"{API_BASE}/accounts/",
+            headers=headers,
+            timeout=15.0,
+            auth=None,  # ignora o JWTAuth da sessão: é este token que está em teste
+        )
+        valid = r.status_code == 200
     except Exception:
         valid = False
 
@@ -51,40 +43,259 @@ async def _validate_token(token: str) -> bool:
     return valid
 
 
-async def login() -> str:
-    """Realiza login via Playwright e retorna token JWT."""
+async def _block_resources(route) -> None:
+    """Aborta recursos que não participam do login (imagens, fontes, analytics...)."""
+    request = route.request
+    if request.resource_type in LOGIN_BLOCKED_RESOURCES or any(
+        host in request.url for host in LOGIN_BLOCKED_HOSTS
+    ):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def _api_login(client: httpx.AsyncClient | None) -> str:
+    """Login direto no endpoint de autenticação do SPA: uma requisição, sem navegador."""
+    payload = {"email": EMAIL, "password": PASSWORD}
+    if client is None:
+        async with httpx.AsyncClient(follow_redirects=True) as own:
+            r = await own.post(LOGIN_API_URL, json=payload, timeout=LOGIN_API_TIMEOUT)
+    else:
+        # auth=None: o JWTAuth da sessão não participa do próprio login
+        r = await client.post(LOGIN_API_URL, json=payload, timeout=LOGIN_API_TIMEOUT, auth=None)
+    r.raise_for_status()
+    data = r.json()
+    for field in LOGIN_TOKEN_FIELDS:
+        token = data.get(field) if isinstance(data, dict) else None
+        if isinstance(token, str) and token:
+            return token
+    raise RuntimeError(f"Resposta de {LOGIN_API_URL} sem token JWT")
+
+
+async def login(client: httpx.AsyncClient | None = None, stale: str | None = None) -> str:
+    """Realiza login e retorna token JWT.
+
+    Com LOGIN_API_URL configurado (COF_LOGIN_API_URL), tenta primeiro o login
+    direto via API; sem ele, ou se ele falhar, usa o fluxo com navegador
+    (_browser_login), cujo Playwright é importado apenas nesse caso. O token
+    não é persistido aqui: use refresh_token (src.token_broker), que
+    serializa os logins entre processos.
+
+    Args:
+        client: Cliente HTTP para o login direto (sem ele, um temporário é criado).
+        stale: Token sendo substituído (ver _browser_login).
+    """
+    if LOGIN_API_URL:
+        try:
+            token = await _api_login(client)
+        except (httpx.HTTPError, ValueError, RuntimeError) as e:
+            logger.warning("Login via API falhou (%s), usando o navegador", e)
+        else:
+            logger.info("Login via API realizado com sucesso (token JWT obtido)")
+            return token
+    return await _browser_login(stale)
+
+
+async def _browser_login(stale: str | None = None) -> str:
+    """Realiza login via Playwright e retorna token JWT.
+
+    O navegador carrega só o essencial (LOGIN_BLOCKED_RESOURCES e
+    LOGIN_BLOCKED_HOSTS são bloqueados) e o fluxo termina assim que o
+    _apiToken aparece no localStorage. O storage_state do navegador é
+    persistido: se a sessão do site ainda vale, o formulário nem é usado.
+
+    Args:
+        stale: Token sendo substituído (revogado ou perto de expirar); não é
+            reaproveitado do storage_state mesmo que o exp ainda o permita.
+    """
+    # Import tardio: o Playwright só é carregado quando o login direto falha
+    from playwright.async_api import async_playwright
+
     logger.info("Realizando login em %s", LOGIN_URL)
 
     async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context()
-        page = await context.new_page()
-
-        await page.goto(LOGIN_URL, wait_until="domcontentloaded")
-        await page.fill('input[type="email"]', EMAIL)
-        await page.fill('input[type="password"]', PASSWORD)
-        await page.click('button[type="submit"]')
-        # Aguardar redirecionamento pós-login
-        await page.wait_for_url(lambda url: "/login" not in url, timeout=15000)
-        await page.wait_for_load_state("networkidle")
-
-        # Extrair token JWT do localStorage
-        token = await page.evaluate("() => localStorage.getItem('_apiToken')")
-        await browser.close()
+        browser = await p.chromium.launch(headless=True, args=LOGIN_BROWSER_ARGS)
+        try:
+            context = await browser.new_context(
+                storage_state=BROWSER_STATE_FILE if BROWSER_STATE_FILE.exists() else None
+            )
+            await context.route("**/*", _block_resources)
+            page = await context.new_page()
+
+            await page.goto(LOGIN_URL, wait_until="domcontentloaded")
+            token = await page.evaluate("() => localStorage.getItem('_apiToken')")
+            if token != stale and token_fresh(token):
+                logger.info("Sessão do navegador ainda válida, formulário de login dispensado")
+            else:
+                # O storage_state restaurado traz o token antigo: descartado, para
+                # que a espera abaixo só termine com o token do novo login
+                await page.evaluate("() => localStorage.removeItem('_apiToken')")
+                await page.fill('input[type="email"]', EMAIL)
+                await page.fill('input[type="password"]', PASSWORD)
+                await page.click('button[type="submit"]')
+                # Termina assim que o SPA grava o token, sem esperar a rede ociosa
+                handle = await page.wait_for_function(
+                    "old => { const t = localStorage.getItem('_apiToken'); return t && t !== old && t; }",
+                    arg=token,
+                    timeout=15000,
+                )
+                token = await handle.json_value()
+
+            BROWSER_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            await context.storage_state(path=BROWSER_STATE_FILE)
+            BROWSER_STATE_FILE.chmod(0o600)
+        finally:
+            await browser.close()
 
     if not token:
         raise RuntimeError("Token JWT não encontrado no localStorage após login")
 
-    _save_token(token)
     logger.info("Login realizado com sucesso (token JWT obtido)")
     return token
 
 
-async def get_authenticated_session() -> str:
-    """Retorna token JWT válido, fazendo re-login se necessário."""
-    token = _load_token()
-    if token and await _validate_token(token):
-        logger.info("Token existente ainda é válido")
+class JWTAuth(httpx.Auth):
+    """Auth do httpx que envia o token atual do TokenManager.
+
+    Um 401 numa requisição real é o único sinal de token revogado: o
+    manager faz novo login e a requisição é repetida uma vez.
+    """
+
+    def __init__(self, manager: "TokenManager") -> None:
+        self._manager = manager
+
+    async def async_auth_flow(self, request: httpx.Request):
+        token = self._manager.token
+        request.headers["Authorization"] = f"JWT {token}"
+        response = yield request
+        if response.status_code == 401:
+            logger.warning("401 em %s, renovando o token", request.url)
+            token = await self._manager.refresh(stale=token)
+            request.headers["Authorization"] = f"JWT {token}"
+            yield request
+
+
+def _expiring(token: str) -> bool:
+    """Token com exp legível que já passou da margem de segurança."""
+    return token_expiry(token) is not None and not token_fresh(token)
+
+
+class TokenManager:
+    """Mantém o token JWT da sessão sem consultar a API a cada batch.
+
+    A validade vem do claim exp, lido localmente: o token é usado até
+    TOKEN_EXPIRY_MARGIN segundos antes de expirar, e a partir de
+    TOKEN_REFRESH_AHEAD segundos antes um novo login é feito em segundo
+    plano, sem bloquear o batch. Novo login imediato só acontece com um 401
+    de uma requisição real (ver JWTAuth) ou quando get() encontra o token já
+    além da margem (ex.: daemon ocioso por horas). Tokens sem exp legível são
+    validados na API, como antes.
+
+    Leitura, gravação e renovação do token passam pelo src.token_broker:
+    processos em paralelo compartilham o mesmo token e nunca logam em dobro.
+
+    verified indica que o token atual já foi confirmado pelo servidor (login
+    recém-feito ou validação na API), o que dispensa o preflight de repetir
+    essa verificação. Deixa de valer quando o token muda ou passa da margem.
+    """
+
+    def __init__(self, client: httpx.AsyncClient) -> None:
+        self._client = client
+        self.token: str | None = None
+        self._verified: str | None = None  # último token confirmado pelo servidor
+        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+
+    async def __aenter__(self) -> "TokenManager":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    @property
+    def verified(self) -> bool:
+        """O token atual foi confirmado pelo servidor e ainda não passou da margem."""
+        return self.token is not None and self.token == self._verified and not _expiring(self.token)
+
+    async def get(self) -> str:
+        """Retorna um token válido, fazendo login só se necessário.
+
+        Um token que já passou da margem (TOKEN_EXPIRY_MARGIN) é renovado
+        aqui, antes de retornar; entre TOKEN_REFRESH_AHEAD e a margem a
+        renovação corre em segundo plano.
+        """
+        if self.token is None:
+            async with self._lock:
+                if self.token is None:
+                    self.token = await self._initial_token()
+        elif _expiring(self.token):
+            logger.info("Token expirado ou perto de expirar, renovando antes de continuar")
+            await self.refresh(self.token)
+        self._schedule_refresh()
+        return self.token
+
+    async def _initial_token(self) -> str:
+        token = load_token()
+        if token:
+            expiry = token_expiry(token)
+            if expiry is None:
+                if await _validate_token(self._client, token):
+                    logger.info("Token existente ainda é válido")
+                    self._verified = token
+                    return token
+            elif token_fresh(token):
+                logger.info(
+                    "Token existente válido até %s", time.strftime("%Y-%m-%d %H:%M", time.localtime(expiry))
+                )
+                return token
+        logger.info("Token expirado ou inexistente, realizando novo login")
+        return await self._login(stale=token)
+
+    async def _login(self, stale: str | None) -> str:
+        token = await refresh_token(lambda: login(self._client, stale=stale), stale)
+        self._verified = token
         return token
-    logger.info("Token expirado ou inexistente, realizando novo login")
-    return await login()
+
+    def _schedule_refresh(self) -> None:
+        expiry = token_expiry(self.token)
+        if expiry is None or expiry - TOKEN_REFRESH_AHEAD > time.time():
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            logger.info("Token expira em breve, renovando em segundo plano")
+            self._refresh_task = asyncio.create_task(self._refresh_ahead(self.token))
+
+    async def _refresh_ahead(self, stale: str) -> None:
+        try:
+            await self.refresh(stale)
+        except Exception as e:
+            # O token atual ainda vale até a margem; o próximo batch tenta de novo
+            logger.warning("Falha ao renovar o token em segundo plano: %s", e)
+
+    async def refresh(self, stale: str | None) -> str:
+        """Faz novo login, a menos que outro chamador já tenha trocado o token stale."""
+        async with self._lock:
+            if self.token is not None and self.token != stale:
+                return self.token
+            self.token = await self._login(stale)
+            return self.token
+
+    async def wait_refresh(self) -> str:
+        """Aguarda a renovação em segundo plano, se houver, e retorna o token corrente."""
+        if self._refresh_task is not None:
+            await self._refresh_task
+        return self.token
+
+    async def aclose(self) -> None:
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+
+
+async def get_token() -> str:
+    """Token válido para scripts avulsos, que não mantêm uma Session.
+
+    Sem um batch para esconder a renovação antecipada, ela é aguardada aqui.
+    """
+    async with httpx.AsyncClient(follow_redirects=True) as client, TokenManager(client) as tokens:
+        await tokens.get()
+        return await tokens.wait_refresh()
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from src.config import BANDWIDTH_BURST, DEFAULT_BANDWIDTH_LIMIT
+from src.scheduler import current_window
+
+logger = logging.getLogger("cof.bandwidth")
+
+# Intervalo (segundos) entre reavaliações do limite da janela vigente
+PROFILE_REFRESH_SECONDS = 30.0
+
+
+def current_limit(now: datetime | None = None) -> int | None:
+    """Limite de banda (bytes/s) da janela de execução vigente; None = sem limite."""
+    match = current_window(now or datetime.now())
+    return match[0].bandwidth if match else DEFAULT_BANDWIDTH_LIMIT
+
+
+def ytdlp_rate_args() -> list[str]:
+    """Argumentos de linha de comando que aplicam o limite vigente ao yt-dlp."""
+    limit = current_limit()
+    return ["--limit-rate", str(limit)] if limit else []
+
+
+class TokenBucket:
+    """Token bucket compartilhado por todos os downloads de um processo.
+
+    Cada bloco recebido consome tokens; sem saldo, o consumidor aguarda o
+    reabastecimento. O saldo pode ficar negativo (dívida), o que mantém a
+    taxa média exata mesmo com blocos maiores que o burst. A taxa segue o
+    limite da janela de execução vigente (EXECUTION_WINDOWS) e é reavaliada periodicamente.
+    """
+
+    def __init__(self, rate: int | None = None, burst: int = BANDWIDTH_BURST) -> None:
+        self._fixed_rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._rate: int | None = None
+        self._rate_checked = float("-inf")
+        self._lock: asyncio.Lock | None = None
+
+    @property
+    def rate(self) -> int | None:
+        if self._fixed_rate is not None:
+            return self._fixed_rate
+        now = time.monotonic()
+        if now - self._rate_checked >= PROFILE_REFRESH_SECONDS:
+            rate = current_limit()
+            if rate != self._rate:
+                logger.info(
+                    "Limite de banda: %s",
+                    f"{rate / (1024 * 1024):.1f} MB/s" if rate else "sem limite",
+                )
+            self._rate = rate
+            self._rate_checked = now
+        return self._rate
+
+    async def consume(self, nbytes: int) -> None:
+        """Debita nbytes do bucket, aguardando se o limite foi excedido."""
+        rate = self.rate
+        if not rate:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # O lock é mantido durante a espera: consumidores são atendidos em ordem
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= nbytes
+            if self._tokens < 0:
+                await asyncio.sleep(-self._tokens / rate)
@@ -0,0 +1,61 @@
+import hashlib
+import logging
+import os
+import shutil
+from pathlib import Path
+
+from src.config import BLOB_DIR
+
+logger = logging.getLogger("cof.blobstore")
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def blob_path(sha256: str) -> Path:
+    """Path do blob com o conteúdo de hash sha256 (data/blobs/ab/abcdef...)."""
+    return BLOB_DIR / sha256[:2] / sha256
+
+
+def has_blob(sha256: str) -> bool:
+    return blob_path(sha256).exists()
+
+
+def hash_file(path: Path) -> str:
+    """Calcula o SHA-256 de um arquivo (bloqueante; usar fora do event loop)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            h.update(block)
+    return h.hexdigest()
+
+
+def store_blob(part: Path, sha256: str) -> Path:
+    """Move um arquivo recém-baixado para o blob store.
+
+    Se o conteúdo já existe (mesmo hash), o arquivo novo é descartado.
+    """
+    blob = blob_path(sha256)
+    if blob.exists():
+        logger.debug("Conteúdo já presente no blob store: %s", sha256[:12])
+        part.unlink()
+    else:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(part, blob)
+    return blob
+
+
+def link_blob(blob: Path, dest: Path) -> None:
+    """Cria dest como hardlink para o blob, substituindo-o atomicamente.
+
+    Se o hardlink não for possível (outro sistema de arquivos, permissões),
+    faz uma cópia.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + ".link")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(blob, tmp)
+    except OSError as e:
+        logger.warning("Hardlink indisponível para %s (%s), copiando", dest.name, e)
+        shutil.copyfile(blob, tmp)
+    os.replace(tmp, dest)
@@ -0,0 +1,80 @@
+import argparse
+
+from src.state import STATUS_DONE, STATUS_DOWNLOADING, STATUS_FAILED, StateStore
+
+_STATUS_LABELS = {
+    STATUS_DONE: "baixado",
+    STATUS_FAILED: "falhou",
+    STATUS_DOWNLOADING: "interrompido",
+}
+
+
+def parse_lessons(value: str) -> tuple[int, int]:
+    """Converte "200-300" (ou "42") num intervalo fechado de aulas."""
+    start, _, end = value.partition("-")
+    try:
+        lo = int(start)
+        hi = int(end) if end else lo
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"intervalo de aulas inválido: {value!r} (ex.: 200-300)")
+    if lo > hi:
+        raise argparse.ArgumentTypeError(f"intervalo de aulas invertido: {value!r}")
+    return lo, hi
+
+
+def _status_label(status: str | None) -> str:
+    return _STATUS_LABELS.get(status, "pendente")
+
+
+def print_items(rows: list) -> None:
+    """Lista itens do catálogo, um por linha."""
+    for row in rows:
+        lesson = f"Aula {row['lesson_number']:03d}" if row["lesson_number"] else "—"
+        print(
+            f"{row['course']} | {lesson} | {row['item_type']} | "
+            f"{_status_label(row['status'])} | {row['title']}"
+        )
+        print(f"    {row['path'] or row['url']}")
+    print(f"{len(rows)} item(s)")
+
+
+def print_summary(rows: list) -> None:
+    """Tabela de contagens por curso e tipo."""
+    header = f"{'Curso':<24} {'Tipo':<14} {'Total':>6} {'Baixados':>9} {'Faltam':>7} {'Falhos':>7} {'MB':>9}"
+    print(header)
+    print("-" * len(header))
+    totals = [0, 0, 0, 0, 0]
+    for row in rows:
+        missing = row["total"] - row["done"]
+        values = (row["total"], row["done"], missing, row["failed"], row["bytes"])
+        totals = [t + v for t, v in zip(totals, values)]
+        print(
+            f"{row['course'][:24]:<24} {row['item_type'][:14]:<14} {row['total']:>6} "
+            f"{row['done']:>9} {missing:>7} {row['failed']:>7} {row['bytes'] / 2**20:>9.0f}"
+        )
+    print("-" * len(header))
+    print(
+        f"{'Total':<24} {'':<14} {totals[0]:>6} {totals[1]:>9} {totals[2]:>7} "
+        f"{totals[3]:>7} {totals[4] / 2**20:>9.0f}"
+    )
+
+
+def run_catalog(args: argparse.Namespace) -> int:
+    """Executa `cof catalog` sobre o catálogo salvo, sem acessar a rede.
+
+    O catálogo é o snapshot gravado pela descoberta dos batches; itens de
+    cursos nunca descobertos não aparecem.
+    """
+    filters = {
+        "course": args.course,
+        "item_type": args.type,
+        "lessons": args.lessons,
+        "status": args.status,
+        "search": args.search,
+    }
+    with StateStore() as store:
+        if args.count:
+            print_summary(store.catalog_summary(**filters))
+        else:
+            print_items(store.query_catalog(**filters, limit=args.limit))
+    return 0
@@ -16,6 +16,9 @@ PASSWORD = os.environ["COF_PASSWORD"]
 BASE_URL = "https://app.seminariodefilosofia.org"
 LOGIN_URL = f"{BASE_URL}/login"
 API_BASE = "https://api.seminariodefilosofia.org/v1"
+# Endpoint de autenticação do SPA para login direto, sem navegador. Opcional:
+# sem COF_LOGIN_API_URL as credenciais só são enviadas pelo formulário (Playwright)
+LOGIN_API_URL = os.environ.get("COF_LOGIN_API_URL") or None
 
 # Cursos a monitorar (id, nome)
 COURSES = [
@@ -25,18 +28,195 @@ COURSES = [
 
 # --- Paths ---
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
-DATA_DIR = PROJECT_ROOT / "data"
+# COF_DATA_DIR permite isolar execuções offline (--transport replay/synthetic) do acervo real
+DATA_DIR = Path(os.environ.get("COF_DATA_DIR", PROJECT_ROOT / "data"))
 AULAS_DIR = DATA_DIR / "aulas"
 EXTRA_DIR = DATA_DIR / "extracurriculares"
-STATE_FILE = DATA_DIR / "state.json"
+BLOB_DIR = DATA_DIR / "blobs"  # conteúdo endereçado por SHA-256 (hardlinks nos cursos)
+STATE_DB = DATA_DIR / "cof.db"
+STATE_FILE = DATA_DIR / "state.json"  # legado, importado para STATE_DB
 COOKIE_FILE = DATA_DIR / "cookies.json"
+TOKEN_FILE = DATA_DIR / "token.json"  # JWT compartilhado por todos os processos
+TOKEN_LOCK_FILE = DATA_DIR / "token.lock"  # lock fcntl da renovação do token
+BROWSER_STATE_FILE = DATA_DIR / "browser_state.json"  # storage_state do Playwright
 LOG_DIR = PROJECT_ROOT / "logs"
 LOG_FILE = LOG_DIR / "agent.log"
 
+# --- Login ---
+# Timeout (s) do login direto via API; se falhar, cai no Playwright
+LOGIN_API_TIMEOUT = 15.0
+# Campos da resposta do login que podem trazer o JWT
+LOGIN_TOKEN_FIELDS = ("token", "access", "_apiToken")
+# Tipos de recurso que o navegador de login (fallback Playwright) não baixa
+LOGIN_BLOCKED_RESOURCES = ("image", "media", "font", "stylesheet")
+# Hosts de terceiros bloqueados (analytics, pixels, chat)
+LOGIN_BLOCKED_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "facebook.net",
+    "facebook.com",
+    "hotjar.com",
+    "doubleclick.net",
+)
+# Flags do Chromium que reduzem memória e trabalho em segundo plano
+LOGIN_BROWSER_ARGS = [
+    "--disable-gpu",
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--mute-audio",
+    "--no-first-run",
+]
+
+# --- Token ---
+# O JWT é considerado expirado esta quantidade de segundos antes do exp
+TOKEN_EXPIRY_MARGIN = 5 * 60
+# A partir de quantos segundos antes do exp um novo login é feito em segundo plano
+TOKEN_REFRESH_AHEAD = 60 * 60
+
 # --- Limites ---
-BATCH_SIZE = (10, 15)
-THROTTLE_SECONDS = 10
-EXECUTION_WINDOWS = [("02:00", "04:00"), ("10:00", "12:00")]
+# Janelas ("HH:MM", "HH:MM", limite de banda); fim antes do início cruza a
+# meia-noite (ex.: 23:00-01:00). O limite (bytes/s, None = sem limite) vale
+# para todos os downloads durante a janela, inclusive o yt-dlp (--limit-rate).
+EXECUTION_WINDOWS = [
+    ("02:00", "04:00", None),
+    ("10:00", "12:00", 1 * 1024 * 1024),  # 1 MB/s: não atrapalhar o uso diurno
+]
+# Espera (s) entre batches na mesma janela quando o anterior não baixou nada
+SCHEDULER_IDLE_WAIT = 10 * 60
+# Maior intervalo (s) dormindo sem conferir o relógio (suspensão, ajustes de hora)
+SCHEDULER_MAX_SLEEP = 60 * 60
+
+# --- Refresh (--refresh) ---
+# Um arquivo já baixado só é conferido de novo no servidor (GET condicional)
+# depois deste intervalo (s) desde a última conferência ou download. No
+# daemon, a passada de refresh roda no primeiro batch e depois no máximo uma
+# vez a cada intervalo.
+REFRESH_INTERVAL = 24 * 3600
+
+# --- Descoberta ---
+# Páginas de um endpoint paginado buscadas em paralelo (após a primeira)
+PAGINATION_CONCURRENCY = 4
+# Cursos descobertos simultaneamente
+DISCOVERY_CONCURRENCY = 4
+# Catálogo salvo no estado: dentro do TTL é usado sem consultar a API; depois
+# disso o fingerprint de cada curso (contagens, ids, ETags) é conferido e só
+# cursos alterados são buscados de novo. Snapshots mais velhos que
+# CATALOG_MAX_AGE são sempre rebuscados por completo.
+CATALOG_TTL = 30 * 60
+CATALOG_MAX_AGE = 7 * 24 * 3600
+
+# --- Planejamento de batch ---
+# Critérios de prioridade, em ordem: "type", "size" (menores primeiro),
+# "lesson" (número da aula) e "course" (ordem de COURSES)
+BATCH_ORDER = ("type", "size", "lesson")
+# Tipos de conteúdo, do mais para o menos prioritário
+TYPE_PRIORITY = ("transcription", "books", "audios", "videos")
+# Orçamento de um batch: bytes e tempo estimado de transferência
+BATCH_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB
+BATCH_MAX_SECONDS = 20 * 60
+# Vazão inicial (bytes/s) até haver medições dos batches anteriores
+ESTIMATED_RATE = 2 * 1024 * 1024
+# Tamanho estimado por tipo enquanto o tamanho real é desconhecido
+SIZE_ESTIMATES = {
+    "transcription": 1 * 1024 * 1024,
+    "books": 5 * 1024 * 1024,
+    "audios": 60 * 1024 * 1024,
+    "videos": 600 * 1024 * 1024,
+}
+DEFAULT_SIZE_ESTIMATE = 10 * 1024 * 1024
+
+# --- Preflight ---
+# Preflight aprovado há menos disto (s) não repete as verificações na API
+PREFLIGHT_TTL = 15 * 60
+# Timeout (s) de cada verificação na API
+PREFLIGHT_TIMEOUT = 10.0
+# Espaço livre mínimo em DATA_DIR para iniciar um batch (um batch inteiro)
+PREFLIGHT_MIN_FREE_BYTES = BATCH_MAX_BYTES
+
+# --- Sessão HTTP ---
+# Cliente único por batch, compartilhado por todas as etapas. HTTP/2 é usado
+# na API quando o pacote h2 está instalado (httpx[http2]).
+HTTP2 = True
+HTTP_MAX_CONNECTIONS = 10
+HTTP_MAX_KEEPALIVE = 10
+HTTP_KEEPALIVE_EXPIRY = 120.0  # segundos que uma conexão ociosa fica no pool
+HTTP_TIMEOUT = 30.0
+# Leitura de arquivos grandes pode ficar parada por mais tempo na CDN
+HTTP_READ_TIMEOUT = 300.0
+
+# --- Transport (execuções offline e benchmarks) ---
+# Cassettes de respostas gravadas (--transport record/replay)
+CASSETTE_DIR = PROJECT_ROOT / "cassettes"
+# Latência por resposta e banda por conexão (bytes/s; None = sem limite)
+# simuladas nos modos replay e synthetic
+TRANSPORT_LATENCY = 0.05
+TRANSPORT_BANDWIDTH = 10 * 1024 * 1024
+# Catálogo sintético: cursos × sources, cada uma com um arquivo deste tamanho
+SYNTHETIC_COURSES = 2
+SYNTHETIC_SOURCES = 200
+SYNTHETIC_FILE_SIZE = 8 * 1024 * 1024
+SYNTHETIC_FILES_HOST = "files.synthetic.invalid"
+
+# --- Resiliência ---
+# Requisições idempotentes que falham com estes status (ou erro de conexão)
+# são repetidas com backoff exponencial e jitter, respeitando o Retry-After
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 1.0
+# Espera máxima entre tentativas; Retry-After maior que isto não é aguardado
+RETRY_MAX_DELAY = 60.0
+# Circuit breaker: falhas seguidas que abrem o circuito de um host, e por quanto tempo
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN = 60.0
+# Com o circuito aberto por mais que isto, a requisição falha em vez de aguardar
+CIRCUIT_MAX_WAIT = 300.0
+
+# --- Download ---
+# Número de workers assíncronos consumindo a fila de downloads
+DOWNLOAD_WORKERS = 4
+# Itens descobertos aguardando download (limita a memória do pipeline)
+DOWNLOAD_QUEUE_DEPTH = 256
+# Conexões simultâneas máximas por host (API vs. CDN de arquivos)
+HOST_CONCURRENCY = {
+    "api.seminariodefilosofia.org": 2,
+}
+DEFAULT_HOST_CONCURRENCY = 3
+# Intervalo mínimo (segundos) entre o início de duas requisições ao mesmo host
+HOST_MIN_INTERVAL = {
+    "api.seminariodefilosofia.org": 1.0,
+}
+DEFAULT_HOST_MIN_INTERVAL = 2.0
+# Tentativas de retomada (Range) de um mesmo arquivo dentro de um batch
+RESUME_ATTEMPTS = 5
+# Tamanho dos blocos lidos da rede
+CHUNK_SIZE = 64 * 1024
+# Download segmentado: arquivos a partir de SEGMENT_THRESHOLD bytes (vídeos,
+# áudios longos) são divididos em SEGMENT_COUNT ranges baixados em paralelo
+SEGMENTED_DOWNLOADS = True
+SEGMENT_THRESHOLD = 64 * 1024 * 1024  # 64 MB
+SEGMENT_COUNT = 4
+
+# --- Banda ---
+# O limite de banda de cada janela fica em EXECUTION_WINDOWS.
+# Limite (bytes/s) fora das janelas (execuções manuais e scripts); None = sem limite
+DEFAULT_BANDWIDTH_LIMIT = None
+# Rajada máxima do token bucket (bytes)
+BANDWIDTH_BURST = 512 * 1024
+
+# --- Escrita em disco ---
+# Threads dedicadas a gravar em disco (fora do event loop)
+WRITER_THREADS = 2
+# Blocos em trânsito por arquivo entre rede e disco (limita a memória)
+WRITE_QUEUE_DEPTH = 64
+# Blocos contíguos são agrupados em escritas de até este tamanho
+WRITE_BUFFER_SIZE = 1024 * 1024  # 1 MB
+# Política de fsync: "never", "close" (ao fechar o arquivo) ou "always" (a cada escrita)
+FSYNC_POLICY = "close"
+
+# --- Verificação (cof verify) ---
+# Processos usados para re-hashear o acervo
+VERIFY_WORKERS = os.cpu_count() or 2
 
 # --- Logging ---
 LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import signal
+import time
+from pathlib import Path
+
+from src.auth import TokenManager
+from src.config import COURSES, REFRESH_INTERVAL
+from src.downloader import download_batch
+from src.preflight import preflight_check
+from src.scheduler import run_scheduler
+from src.scraper import iter_media
+from src.session import Session
+from src.state import StateStore
+from src.transport import SyntheticTransport, create_transport
+
+logger = logging.getLogger("cof.daemon")
+
+
+class Daemon:
+    """Recursos de um agente de longa duração, mantidos entre batches.
+
+    Sessão HTTP (pool de conexões), token, estado (conexão SQLite) e, por
+    meio dele, o catálogo são criados uma vez e reaproveitados por todos os
+    batches. Cada um só é renovado quando fica velho: o token pelo
+    TokenManager (exp ou 401), o preflight da API por PREFLIGHT_TTL, o
+    catálogo por CATALOG_TTL e, com --refresh, a conferência dos arquivos
+    já baixados por REFRESH_INTERVAL. Num batch em regime, a preparação se
+    resume a leituras locais no estado.
+
+    Um batch avulso (--once) usa a mesma classe, com um único run_batch.
+    """
+
+    def __init__(
+        self,
+        dry_run: bool = False,
+        refresh: bool = False,
+        transport: str = "live",
+        cassette: Path | None = None,
+    ) -> None:
+        self._dry_run = dry_run
+        self._refresh = refresh
+        self._refreshed_at: float | None = None  # monotonic da última passada de --refresh
+        # Offline: o transport não confere o token
+        self._offline = transport in ("replay", "synthetic")
+        base_transport = create_transport(transport, cassette)
+        self.courses = base_transport.courses if isinstance(base_transport, SyntheticTransport) else COURSES
+        self.session = Session(transport=base_transport)
+        self.tokens = TokenManager(self.session.api)
+        self.store = StateStore()
+        self.batches = 0
+
+    async def __aenter__(self) -> "Daemon":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self.tokens.aclose()
+        await self.session.aclose()
+        self.store.close()
+
+    async def _authenticate(self) -> None:
+        if self._offline:
+            if self.session.token is None:
+                self.session.set_token("offline")
+            return
+        first = self.tokens.token is None
+        await self.tokens.get()  # sem IO enquanto o token vale
+        if first:
+            self.session.set_auth(self.tokens)
+
+    def _refresh_due(self) -> bool:
+        """--refresh confere o acervo no primeiro batch e depois a cada REFRESH_INTERVAL."""
+        if not self._refresh:
+            return False
+        now = time.monotonic()
+        if self._refreshed_at is not None and now - self._refreshed_at < REFRESH_INTERVAL:
+            return False
+        self._refreshed_at = now
+        return True
+
+    async def run_batch(self, deadline: float | None = None) -> int:
+        """Executa um batch; retorna o número de arquivos baixados.
+
+        deadline (epoch) é o instante em que o batch deve parar (fim da
+        janela de execução, ver run_scheduler).
+        """
+        self.batches += 1
+        started = time.monotonic()
+        logger.info("=== Iniciando batch %d ===", self.batches)
+
+        # 1. Autenticação
+        logger.info("Etapa 1/4: Autenticação")
+        await self._authenticate()
+
+        # 2. Preflight
+        logger.info("Etapa 2/4: Verificações pré-voo")
+        if not await preflight_check(self.session.api, token_verified=self.tokens.verified, store=self.store):
+            logger.error("Preflight falhou. Abortando batch.")
+            return 0
+        logger.debug("Preparação do batch em %.2fs", time.monotonic() - started)
+
+        # 3. Descoberta, alimentando o download à medida que os itens chegam
+        logger.info("Etapa 3/4: Descoberta de conteúdo")
+        items = iter_media(self.session.api, self.courses, store=self.store)
+
+        # 4. Download
+        logger.info("Etapa 4/4: Download (em paralelo com a descoberta)")
+        downloaded = await download_batch(
+            items, self.session.files,
+            dry_run=self._dry_run, refresh=self._refresh_due(), deadline=deadline, store=self.store,
+            limiter=self.session.limiter,
+        )
+        logger.info("=== Batch concluído: %d arquivos baixados ===", len(downloaded))
+        return len(downloaded)
+
+    async def serve(self) -> None:
+        """Executa batches nas janelas de execução até ser interrompido (SIGTERM/Ctrl+C)."""
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        loop.add_signal_handler(signal.SIGTERM, task.cancel)
+        try:
+            await run_scheduler(self.run_batch)
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+
+
+async def run_daemon(**kwargs) -> None:
+    """Modo daemon: um único event loop e recursos quentes entre os batches."""
+    logger.info("Daemon iniciado")
+    try:
+        async with Daemon(**kwargs) as daemon:
+            await daemon.serve()
+    except asyncio.CancelledError:
+        logger.info("Daemon encerrado")
@@ -1,103 +1,704 @@
 import asyncio
+import itertools
 import json
 import logging
-import random
+import os
+import time
+from collections.abc import AsyncGenerator, AsyncIterable, Iterable
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
 
 import httpx
 
-from src.config import THROTTLE_SECONDS, BATCH_SIZE, STATE_FILE
+from src import blobstore
+from src.config import (
+    BATCH_MAX_SECONDS,
+    CHUNK_SIZE,
+    DOWNLOAD_QUEUE_DEPTH,
+    DOWNLOAD_WORKERS,
+    REFRESH_INTERVAL,
+    RESUME_ATTEMPTS,
+    SEGMENT_COUNT,
+    SEGMENT_THRESHOLD,
+    SEGMENTED_DOWNLOADS,
+)
 from src.naming import generate_filename
-from src.preflight import get_random_ua
+from src.planner import BatchBudget, estimate_size, queue_key, record_throughput
+from src.resilience import HostLimiter
+from src.state import SCOPE_COF, StateStore
+from src.writer import FileWriter, open_writer
 
 logger = logging.getLogger("cof.downloader")
 
+PART_SUFFIX = ".part"
+SEGMENTS_SUFFIX = ".json"
+# Progresso de um segmento é persistido a cada SEGMENT_CHECKPOINT bytes
+SEGMENT_CHECKPOINT = 8 * 1024 * 1024
 
-def load_state() -> dict:
-    """Carrega estado persistente do disco."""
-    if STATE_FILE.exists():
-        with open(STATE_FILE) as f:
-            data = json.load(f)
-        data["downloaded"] = set(data.get("downloaded", []))
-        return data
-    return {"downloaded": set()}
 
+class IncompleteDownloadError(Exception):
+    """O arquivo recebido não tem o tamanho anunciado pelo servidor."""
 
-def save_state(state: dict) -> None:
-    """Salva estado persistente em disco."""
-    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    serializable = {**state, "downloaded": list(state["downloaded"])}
-    with open(STATE_FILE, "w") as f:
-        json.dump(serializable, f, indent=2)
 
+class RangeNotSupportedError(IncompleteDownloadError):
+    """O servidor deixou de responder a requisições Range com 206."""
 
-async def _download_file(client: httpx.AsyncClient, url: str, dest: Path) -> None:
-    """Download com streaming para arquivos grandes."""
-    async with client.stream("GET", url) as resp:
-        resp.raise_for_status()
-        dest.parent.mkdir(parents=True, exist_ok=True)
-        with open(dest, "wb") as f:
-            async for chunk in resp.aiter_bytes(chunk_size=8192):
-                f.write(chunk)
 
-    size_mb = dest.stat().st_size / (1024 * 1024)
-    logger.debug("Arquivo salvo: %s (%.1f MB)", dest.name, size_mb)
+@dataclass
+class Segment:
+    """Faixa [start, end) de um download segmentado; pos é o próximo byte."""
 
+    start: int
+    end: int
+    pos: int
 
-async def download_batch(items: list, token: str, dry_run: bool = False) -> list[Path]:
-    """Baixa um lote de arquivos respeitando throttle e limites.
+    @property
+    def done(self) -> bool:
+        return self.pos >= self.end
+
+
+@dataclass
+class DownloadResult:
+    """Resultado de download_file."""
+
+    path: Path
+    size: int
+    sha256: str
+    etag: str | None = None
+    last_modified: str | None = None
+    reused: bool = False  # conteúdo já estava no blob store; nada foi transferido
+
+
+@dataclass
+class _Transfer:
+    """Estado de um download em andamento (persistido no arquivo lateral do .part)."""
+
+    part: Path
+    total: int | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+    segments: list[Segment] = field(default_factory=list)
+    sha256: str | None = None
+    reused: bool = False
+    not_modified: bool = False
+
+    @property
+    def if_range(self) -> str | None:
+        """Validador para If-Range (só ETags fortes são aceitos pelo protocolo)."""
+        if self.etag and not self.etag.startswith("W/"):
+            return self.etag
+        return self.last_modified
+
+
+def part_path(dest: Path) -> Path:
+    """Retorna o path do arquivo parcial (.part) correspondente a dest."""
+    return dest.with_name(dest.name + PART_SUFFIX)
+
+
+def _segments_path(part: Path) -> Path:
+    """Arquivo lateral com o progresso de um download segmentado."""
+    return part.with_name(part.name + SEGMENTS_SUFFIX)
+
+
+def _content_range_total(value: str | None) -> int | None:
+    """Extrai o tamanho total de um header Content-Range ("bytes 0-99/1234")."""
+    if not value or "/" not in value:
+        return None
+    total = value.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+
+def _split_segments(total: int, count: int) -> list[Segment]:
+    """Divide [0, total) em count faixas contíguas de tamanho semelhante."""
+    size = -(-total // count)
+    return [
+        Segment(start, min(start + size, total), start)
+        for start in range(0, total, size)
+    ]
+
+
+def _load_plan(t: _Transfer) -> bool:
+    """Carrega o plano de segmentos salvo para o .part, se houver."""
+    path = _segments_path(t.part)
+    if not path.exists() or not t.part.exists():
+        path.unlink(missing_ok=True)
+        return False
+    try:
+        data = json.loads(path.read_text())
+        t.total = data["total"]
+        t.etag = data.get("etag")
+        t.last_modified = data.get("last_modified")
+        t.segments = [Segment(**seg) for seg in data["segments"]]
+        return True
+    except (ValueError, KeyError, TypeError):
+        # O .part pré-alocado não tem como ser retomado sem o plano
+        logger.warning("Progresso segmentado corrompido em %s, descartando", path.name)
+        _discard_partial(t.part)
+        return False
+
+
+def _save_plan(t: _Transfer, segments: list[Segment] | None = None) -> None:
+    """Persiste o plano e o progresso dos segmentos de forma atômica."""
+    path = _segments_path(t.part)
+    tmp = path.with_name(path.name + ".tmp")
+    data = {
+        "total": t.total,
+        "etag": t.etag,
+        "last_modified": t.last_modified,
+        "segments": [asdict(s) for s in (t.segments if segments is None else segments)],
+    }
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+def _discard_partial(part: Path) -> None:
+    """Remove o .part e o progresso segmentado associado."""
+    part.unlink(missing_ok=True)
+    _segments_path(part).unlink(missing_ok=True)
+
+
+def _should_segment(total: int | None) -> bool:
+    return SEGMENTED_DOWNLOADS and SEGMENT_COUNT > 1 and total is not None and total >= SEGMENT_THRESHOLD
+
+
+def _start_plan(t: _Transfer) -> None:
+    """Cria o plano de segmentos de um download com tamanho conhecido.
+
+    Downloads abaixo de SEGMENT_THRESHOLD têm um único segmento; o plano
+    existe mesmo assim porque o .part é pré-alocado e seu tamanho deixa de
+    indicar o progresso.
+    """
+    count = SEGMENT_COUNT if _should_segment(t.total) else 1
+    t.segments = _split_segments(t.total, count)
+    # O plano é gravado antes da pré-alocação: um .part sem plano seria
+    # confundido com um download sequencial já completo.
+    _save_plan(t)
+    t.part.touch()
+    if count > 1:
+        logger.info(
+            "Download segmentado de %s: %.1f MB em %d segmentos",
+            t.part.name, t.total / (1024 * 1024), count,
+        )
+
+
+def _checkpointer(t: _Transfer, writer: FileWriter):
+    """Cria a função que persiste o progresso já gravado em disco."""
+
+    async def checkpoint() -> None:
+        # Posições capturadas antes do drain: tudo até elas já está no disco
+        snapshot = [Segment(s.start, s.end, s.pos) for s in t.segments]
+        await writer.drain()
+        _save_plan(t, snapshot)
+
+    return checkpoint
+
+
+async def _stream_segment(
+    resp: httpx.Response, writer: FileWriter, segment: Segment, limiter: HostLimiter, checkpoint
+) -> None:
+    """Encaminha o corpo da resposta ao writer na posição do segmento."""
+    since_checkpoint = 0
+    async for chunk in resp.aiter_bytes(chunk_size=CHUNK_SIZE):
+        if segment.pos + len(chunk) > segment.end:
+            raise IncompleteDownloadError("segmento maior que o solicitado")
+        await limiter.throttle(len(chunk))
+        await writer.write(segment.pos, chunk)
+        segment.pos += len(chunk)
+        since_checkpoint += len(chunk)
+        if since_checkpoint >= SEGMENT_CHECKPOINT:
+            await checkpoint()
+            since_checkpoint = 0
+    if not segment.done:
+        raise IncompleteDownloadError(
+            f"segmento {segment.start}-{segment.end}: {segment.pos - segment.start} "
+            f"de {segment.end - segment.start} bytes"
+        )
+
+
+def _known_content(t: _Transfer, store: StateStore | None) -> bool:
+    """Verifica, por ETag e tamanho, se o conteúdo já está no blob store."""
+    if store is None or not t.etag or t.total is None:
+        return False
+    sha256 = store.find_content(t.etag, t.total)
+    if sha256 and blobstore.has_blob(sha256):
+        t.sha256 = sha256
+        t.reused = True
+        return True
+    return False
+
+
+def _read_validators(t: _Transfer, resp: httpx.Response) -> None:
+    t.etag = resp.headers.get("etag")
+    t.last_modified = resp.headers.get("last-modified")
+
+
+async def _fetch_into_part(
+    client: httpx.AsyncClient,
+    url: str,
+    t: _Transfer,
+    limiter: HostLimiter,
+    store: StateStore | None,
+    conditional: dict[str, str] | None = None,
+) -> bool:
+    """Baixa (ou continua baixando) url para o arquivo parcial em um único stream.
+
+    A primeira requisição sempre pede um Range: a resposta 206 confirma o
+    suporte a ranges e informa o tamanho total, usado para pré-alocar o
+    arquivo. Seus headers também servem de sonda: se ETag e tamanho
+    correspondem a um conteúdo já conhecido, a transferência é abortada.
+    Arquivos grandes o bastante são delegados ao modo segmentado.
+
+    Returns:
+        True se o download terminou (ou o conteúdo foi reaproveitado, ou não
+        mudou desde a última versão); False se deve prosseguir em modo
+        segmentado.
+    """
+    part = t.part
+    offset = part.stat().st_size if part.exists() else 0
+    headers = {"Accept-Encoding": "identity", "Range": f"bytes={offset}-"}
+    if conditional and not offset:
+        headers.update(conditional)
+
+    async with limiter.transfer(url):
+        async with client.stream("GET", url, headers=headers) as resp:
+            if resp.status_code == 304:
+                _read_validators(t, resp)
+                t.not_modified = True
+                return True
+            if resp.status_code == 416 and offset:
+                # Range além do fim: o .part pode já estar completo
+                if _content_range_total(resp.headers.get("content-range")) == offset:
+                    t.total = offset
+                    return True
+                part.unlink()
+                raise IncompleteDownloadError("Range rejeitado, reiniciando do zero")
+            resp.raise_for_status()
+            _read_validators(t, resp)
+
+            if resp.status_code == 206:
+                t.total = _content_range_total(resp.headers.get("content-range"))
+                if offset:
+                    logger.info("Retomando %s a partir de %.1f MB", part.name, offset / (1024 * 1024))
+                elif t.total:
+                    if _known_content(t, store):
+                        return True
+                    _start_plan(t)
+                    if len(t.segments) > 1:
+                        return False
+                    async with open_writer(part, preallocate=t.total, truncate=True) as writer:
+                        checkpoint = _checkpointer(t, writer)
+                        try:
+                            await _stream_segment(resp, writer, t.segments[0], limiter, checkpoint)
+                        finally:
+                            await checkpoint()
+                    if writer.hashed_bytes == t.total:
+                        t.sha256 = writer.sha256
+                    _segments_path(part).unlink(missing_ok=True)
+                    return True
+            else:
+                if offset:
+                    logger.info("Servidor ignorou Range para %s, reiniciando do zero", part.name)
+                    offset = 0
+                length = resp.headers.get("content-length")
+                t.total = int(length) if length and length.isdigit() else None
+                if _known_content(t, store):
+                    return True
+
+            # Stream sequencial: retomada de um .part antigo ou servidor sem Range
+            position = offset
+            try:
+                async with open_writer(
+                    part, preallocate=None if offset else t.total, truncate=not offset
+                ) as writer:
+                    async for chunk in resp.aiter_bytes(chunk_size=CHUNK_SIZE):
+                        await limiter.throttle(len(chunk))
+                        await writer.write(position, chunk)
+                        position += len(chunk)
+            except BaseException:
+                if resp.status_code == 200 and t.total:
+                    # Pré-alocado e sem Range: não há como retomar
+                    part.unlink(missing_ok=True)
+                raise
+            if not offset and writer.hashed_bytes == position:
+                t.sha256 = writer.sha256
+
+    size = part.stat().st_size
+    if t.total is not None and (size != t.total or position != t.total):
+        if size > t.total or position != size:
+            part.unlink()
+        raise IncompleteDownloadError(f"{position} de {t.total} bytes recebidos")
+    t.total = size
+    return True
+
+
+async def _fetch_segment(
+    client: httpx.AsyncClient,
+    url: str,
+    t: _Transfer,
+    writer: FileWriter,
+    segment: Segment,
+    limiter: HostLimiter,
+    checkpoint,
+) -> None:
+    """Baixa o restante de um segmento, gravando-o na posição correta do arquivo.
+
+    O If-Range garante que os bytes vêm da mesma versão do arquivo; se ele
+    mudou no servidor, a resposta é 200 e o download recomeça do zero.
+    """
+    headers = {"Accept-Encoding": "identity", "Range": f"bytes={segment.pos}-{segment.end - 1}"}
+    if t.if_range:
+        headers["If-Range"] = t.if_range
+    async with limiter.transfer(url):
+        async with client.stream("GET", url, headers=headers) as resp:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                raise RangeNotSupportedError("servidor deixou de aceitar Range")
+            await _stream_segment(resp, writer, segment, limiter, checkpoint)
+
+
+async def _fetch_segments(
+    client: httpx.AsyncClient, url: str, t: _Transfer, limiter: HostLimiter
+) -> None:
+    """Baixa em paralelo os segmentos pendentes de um download com plano salvo."""
+    pending = [s for s in t.segments if not s.done]
+
+    async with open_writer(t.part, preallocate=t.total) as writer:
+        checkpoint = _checkpointer(t, writer)
+        try:
+            results = await asyncio.gather(
+                *(_fetch_segment(client, url, t, writer, seg, limiter, checkpoint) for seg in pending),
+                return_exceptions=True,
+            )
+        finally:
+            # Em falha de disco o drain levanta e o último checkpoint válido é mantido
+            await checkpoint()
+
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        if any(isinstance(e, RangeNotSupportedError) for e in errors):
+            # Sem suporte a ranges não há como continuar: recomeça em um único stream
+            _discard_partial(t.part)
+        raise errors[0]
+
+    _segments_path(t.part).unlink(missing_ok=True)
+
+
+async def download_file(
+    client: httpx.AsyncClient,
+    url: str,
+    dest: Path,
+    limiter: HostLimiter | None = None,
+    store: StateStore | None = None,
+    conditional: dict[str, str] | None = None,
+) -> DownloadResult | None:
+    """Download resumível com streaming para arquivos grandes.
+
+    Os bytes são gravados em <dest>.part; falhas de rede são retomadas com
+    requisições Range (inclusive entre execuções). Arquivos a partir de
+    SEGMENT_THRESHOLD são baixados em SEGMENT_COUNT ranges paralelos quando o
+    servidor aceita Range; caso contrário, em um único stream.
+
+    O conteúdo completo vai para o blob store (endereçado por SHA-256) e dest
+    vira um hardlink para o blob. Com store, um conteúdo já conhecido (mesmo
+    ETag e tamanho) é reaproveitado sem ser transferido.
+
+    Args:
+        conditional: Headers If-None-Match/If-Modified-Since da versão local;
+            se o servidor responder 304, retorna None sem tocar em dest.
+    """
+    limiter = limiter or HostLimiter()
+    t = _Transfer(part_path(dest))
+    dest.parent.mkdir(parents=True, exist_ok=True)
+
+    for attempt in range(1, RESUME_ATTEMPTS + 1):
+        try:
+            if not _load_plan(t):
+                if await _fetch_into_part(client, url, t, limiter, store, conditional):
+                    break
+            await _fetch_segments(client, url, t, limiter)
+            break
+        except (httpx.TransportError, IncompleteDownloadError) as e:
+            if attempt == RESUME_ATTEMPTS:
+                raise
+            delay = min(2 ** attempt, 30)
+            logger.warning(
+                "Download interrompido (%s): %s — nova tentativa %d/%d em %ds",
+                dest.name, e, attempt + 1, RESUME_ATTEMPTS, delay,
+            )
+            await asyncio.sleep(delay)
+
+    if t.not_modified:
+        return None
+    if t.reused:
+        _discard_partial(t.part)
+        blob = blobstore.blob_path(t.sha256)
+        logger.info("Conteúdo já conhecido, reaproveitado sem download: %s", dest.name)
+    else:
+        if t.sha256 is None:
+            # Retomado ou segmentado: o hash não pôde ser calculado no streaming
+            t.sha256 = await asyncio.to_thread(blobstore.hash_file, t.part)
+        t.total = t.part.stat().st_size
+        blob = blobstore.store_blob(t.part, t.sha256)
+    blobstore.link_blob(blob, dest)
+
+    logger.debug("Arquivo salvo: %s (%.1f MB)", dest.name, t.total / (1024 * 1024))
+    return DownloadResult(dest, t.total, t.sha256, t.etag, t.last_modified, t.reused)
+
+
+def conditional_headers(row) -> dict[str, str]:
+    """Monta os headers de GET condicional a partir do registro de estado."""
+    headers = {}
+    if row["etag"]:
+        headers["If-None-Match"] = row["etag"]
+    if row["last_modified"]:
+        headers["If-Modified-Since"] = row["last_modified"]
+    return headers
+
+
+async def _probe(
+    client: httpx.AsyncClient, url: str, limiter: HostLimiter
+) -> tuple[str | None, str | None, int | None]:
+    """Obtém ETag, Last-Modified e tamanho total pedindo apenas o primeiro byte."""
+    headers = {"Accept-Encoding": "identity", "Range": "bytes=0-0"}
+    async with limiter.transfer(url):
+        async with client.stream("GET", url, headers=headers) as resp:
+            resp.raise_for_status()
+            if resp.status_code == 206:
+                total = _content_range_total(resp.headers.get("content-range"))
+            else:
+                length = resp.headers.get("content-length")
+                total = int(length) if length and length.isdigit() else None
+            return resp.headers.get("etag"), resp.headers.get("last-modified"), total
+
+
+async def refresh_file(
+    client: httpx.AsyncClient,
+    url: str,
+    dest: Path,
+    row,
+    limiter: HostLimiter,
+    store: StateStore,
+) -> DownloadResult | None:
+    """Confere se um arquivo já baixado mudou no servidor e, se sim, baixa de novo.
+
+    Com validadores registrados, envia um GET condicional (304 = sem mudança).
+    Registros antigos, sem validadores, são sondados pelo primeiro byte: os
+    validadores passam a ser registrados e o arquivo só é baixado de novo se
+    o tamanho remoto for diferente do local.
+
+    Returns:
+        DownloadResult da nova versão, ou None se nada mudou.
+    """
+    conditional = conditional_headers(row)
+    if not conditional and dest.exists():
+        etag, last_modified, total = await _probe(client, url, limiter)
+        if total is None or total == dest.stat().st_size:
+            store.mark_checked(url, etag, last_modified, total)
+            return None
+    result = await download_file(client, url, dest, limiter, store, conditional or None)
+    if result is None:
+        store.mark_checked(url)
+    return result
+
+
+# Sentinela na fila de prioridade: ordena depois de qualquer item
+_LAST = (float("inf"),)
+# Conferências (--refresh) vão antes dos downloads novos
+_CHECK = (0,)
+_NEW = 1
+
+
+@dataclass
+class _Batch:
+    """Estado compartilhado pelos workers de um batch."""
+
+    store: StateStore
+    client: httpx.AsyncClient
+    limiter: HostLimiter
+    budget: BatchBudget
+    dry_run: bool
+    downloaded: list[Path] = field(default_factory=list)
+    checked: int = 0
+    # Liberado com a fila cheia ou a descoberta concluída: a prioridade vale para o lote todo
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+async def _worker(name: str, queue: asyncio.PriorityQueue, batch: _Batch) -> None:
+    """Consome itens da fila (em ordem de prioridade) até receber o sentinela."""
+    store = batch.store
+    await batch.ready.wait()
+    while True:
+        key, _, size, item = await queue.get()
+        try:
+            if item is None:
+                return
+            if key == _CHECK:
+                # Item concluído, conferido com GET condicional (--refresh)
+                row = store.get(item.media_url)
+                dest = Path(row["path"]) if row["path"] else generate_filename(item)
+                batch.checked += 1
+                try:
+                    result = await refresh_file(
+                        batch.client, item.media_url, dest, row, batch.limiter, store
+                    )
+                except Exception as e:
+                    logger.error("Falha ao conferir '%s': %s", item.title, e)
+                    continue
+                if result is None:
+                    logger.debug("Sem alterações: %s", dest.name)
+                    continue
+            else:
+                # O orçamento é conferido na saída da fila: o que não cabe fica pendente
+                if not batch.budget.take(size):
+                    continue
+                dest = generate_filename(item)
+                if batch.dry_run:
+                    logger.info("[DRY RUN] Seria baixado: %s -> %s", item.title, dest.name)
+                    continue
+                store.mark_started(item.media_url, SCOPE_COF, dest)
+                try:
+                    result = await download_file(
+                        batch.client, item.media_url, dest, batch.limiter, store
+                    )
+                except Exception as e:
+                    store.mark_failed(item.media_url, SCOPE_COF, str(e))
+                    logger.error("Falha no download de '%s': %s", item.title, e)
+                    continue
+            store.mark_done(
+                item.media_url, SCOPE_COF, dest,
+                size=result.size, sha256=result.sha256,
+                etag=result.etag, last_modified=result.last_modified,
+            )
+            batch.downloaded.append(dest)
+            logger.info("Baixado (%d) [%s]: %s", len(batch.downloaded), name, dest.name)
+        finally:
+            queue.task_done()
+
+
+async def _aiter(items: Iterable | AsyncIterable) -> AsyncGenerator:
+    if isinstance(items, AsyncIterable):
+        try:
+            async for item in items:
+                yield item
+        finally:
+            # Fecha a descoberta (tarefas e requisições em andamento) junto com o batch
+            if hasattr(items, "aclose"):
+                await items.aclose()
+    else:
+        for item in items:
+            yield item
+
+
+async def _put(queue: asyncio.PriorityQueue, entry: tuple, batch: _Batch) -> None:
+    """Enfileira entry; com a fila cheia, libera os workers antes de aguardar espaço."""
+    if queue.full():
+        batch.ready.set()
+    await queue.put(entry)
+
+
+async def download_batch(
+    items: Iterable | AsyncIterable,
+    client: httpx.AsyncClient,
+    dry_run: bool = False,
+    refresh: bool = False,
+    deadline: float | None = None,
+    store: StateStore | None = None,
+    limiter: HostLimiter | None = None,
+) -> list[Path]:
+    """Baixa um lote de arquivos com um pool de workers concorrentes.
+
+    items pode ser um iterador assíncrono (ex.: scraper.iter_media), que é
+    fechado ao fim do batch (inclusive no prazo). Os itens passam por uma
+    fila de prioridade limitada (DOWNLOAD_QUEUE_DEPTH), ordenada pelos
+    critérios de BATCH_ORDER, e o orçamento do batch é conferido na saída da
+    fila. Os workers só começam quando a fila enche ou a descoberta termina,
+    sem esperar o fim de descobertas longas: a ordem de prioridade vale para
+    o lote inteiro da fila, e não só para os primeiros itens que chegam. A
+    memória fica limitada pela profundidade da fila, e não pelo tamanho do
+    catálogo.
+
+    A concorrência e o ritmo são controlados por host (HostLimiter), de modo
+    que a API e a CDN de arquivos têm limites independentes.
 
     Args:
-        items: Lista de MediaItem para download.
-        token: Token JWT de autenticação.
+        items: MediaItems para download (iterável ou iterador assíncrono).
+        client: Cliente de arquivos da sessão, já autenticado (Session.files).
         dry_run: Se True, apenas lista os arquivos sem baixar.
+        refresh: Se True, confere também os itens já baixados com GET
+            condicional (If-None-Match/If-Modified-Since) e baixa de novo
+            apenas os que mudaram. Itens conferidos ou baixados há menos de
+            REFRESH_INTERVAL são pulados.
+        deadline: Instante (epoch) em que o batch deve parar, em geral o fim
+            da janela de execução. O orçamento de tempo não passa dele, e
+            downloads ainda em andamento nesse instante são interrompidos
+            (o .part é retomado no próximo batch).
+        store: Estado já aberto a reaproveitar (modo daemon); sem ele, um é aberto.
+        limiter: Limiter da sessão (Session.limiter), que mantém o pacing por
+            host entre batches; sem ele, um novo é criado para o batch.
 
     Returns:
-        Lista de paths dos arquivos baixados.
+        Lista de paths dos arquivos baixados (ou atualizados).
     """
-    state = load_state()
-    pending = [i for i in items if i.media_url not in state["downloaded"]]
+    with nullcontext(store) if store is not None else StateStore() as store:
+        return await _download_stream(store, _aiter(items), client, dry_run, refresh, deadline, limiter)
 
-    if not pending:
-        logger.info("Nenhum arquivo pendente para download.")
-        return []
 
-    batch_size = random.randint(*BATCH_SIZE)
-    batch = pending[:batch_size]
-    logger.info(
-        "%d pendentes, batch de %d selecionado (%d restantes após batch)",
-        len(pending), len(batch), len(pending) - len(batch),
-    )
-
-    if dry_run:
-        for item in batch:
-            dest = generate_filename(item)
-            logger.info("[DRY RUN] Seria baixado: %s -> %s", item.title, dest.name)
-        return []
+async def _download_stream(
+    store: StateStore,
+    items: AsyncGenerator,
+    client: httpx.AsyncClient,
+    dry_run: bool,
+    refresh: bool,
+    deadline: float | None = None,
+    limiter: HostLimiter | None = None,
+) -> list[Path]:
+    """Enfileira os itens pendentes à medida que chegam e executa o pool de workers."""
+    remaining = None if deadline is None else max(0.0, deadline - time.time())
+    # O orçamento de tempo não passa do deadline
+    max_seconds = BATCH_MAX_SECONDS if remaining is None else min(BATCH_MAX_SECONDS, remaining)
+    budget = BatchBudget(store, max_seconds=max_seconds)
+    batch = _Batch(store, client, limiter or HostLimiter(), budget, dry_run)
+    # O limiter pode ser da sessão (daemon): a vazão do batch é a diferença
+    received, busy = batch.limiter.received, batch.limiter.busy_seconds
+    queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=DOWNLOAD_QUEUE_DEPTH)
+    seq = itertools.count()
+    pending = 0
+    workers = [
+        asyncio.create_task(_worker(f"w{n}", queue, batch)) for n in range(DOWNLOAD_WORKERS)
+    ]
+    try:
+        async with asyncio.timeout(remaining):
+            async for item in items:
+                if store.is_done(item.media_url):
+                    if refresh and not dry_run and store.check_due(item.media_url, REFRESH_INTERVAL):
+                        await _put(queue, (_CHECK, next(seq), 0, item), batch)
+                    continue
+                pending += 1
+                size = estimate_size(item, store)
+                await _put(queue, ((_NEW, *queue_key(item, size)), next(seq), size, item), batch)
+            batch.ready.set()
+            for _ in workers:
+                await queue.put((_LAST, next(seq), 0, None))
+            await asyncio.gather(*workers)
+    except TimeoutError:
+        logger.warning("Prazo do batch atingido: downloads em andamento interrompidos (serão retomados)")
+    finally:
+        # Prazo, erro ou cancelamento: os workers param já, sem esvaziar a fila
+        # (o que ficou nela é redescoberto no próximo batch)
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await items.aclose()
 
-    downloaded: list[Path] = []
-    headers = {
-        "Authorization": f"JWT {token}",
-        "User-Agent": get_random_ua(),
-    }
+    if not pending and not batch.checked:
+        logger.info("Nenhum arquivo pendente para download.")
+        return []
+    batch.budget.log_summary()
+    if refresh:
+        logger.info("Modo refresh: %d arquivos já baixados conferidos", batch.checked)
 
-    async with httpx.AsyncClient(
-        headers=headers, follow_redirects=True, timeout=300.0
-    ) as client:
-        for i, item in enumerate(batch):
-            dest = generate_filename(item)
-            try:
-                await _download_file(client, item.media_url, dest)
-                state["downloaded"].add(item.media_url)
-                save_state(state)
-                downloaded.append(dest)
-                logger.info("Baixado (%d/%d): %s", i + 1, len(batch), dest.name)
-            except Exception as e:
-                logger.error("Falha no download de '%s': %s", item.title, e)
-
-            # Throttle entre downloads (exceto após o último)
-            if i < len(batch) - 1:
-                logger.debug("Aguardando %ds antes do próximo download...", THROTTLE_SECONDS)
-                await asyncio.sleep(THROTTLE_SECONDS)
-
-    return downloaded
+    # Bytes que vieram da rede sobre o tempo em transferência: espera por
+    # slot, pacing entre requisições e espera pela descoberta não contam
+    record_throughput(store, batch.limiter.received - received, batch.limiter.busy_seconds - busy)
+    return batch.downloaded
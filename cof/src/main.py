@@ -1,50 +1,46 @@
 import argparse
 import asyncio
 import logging
+import os
 import sys
+from pathlib import Path
 
-from src.config import setup_logging
-from src.auth import get_authenticated_session
-from src.preflight import preflight_check
-from src.scraper import discover_media
-from src.downloader import download_batch
-from src.scheduler import run_scheduler
+from src.config import VERIFY_WORKERS, setup_logging
+from src.catalog import parse_lessons, run_catalog
+from src.daemon import Daemon, run_daemon
+from src.state import CATALOG_STATUSES, StateStore
+from src.transport import TRANSPORT_MODES
+from src.verify import verify_library
 
 logger: logging.Logger
 
 
-async def execute_batch(dry_run: bool = False) -> None:
-    """Fluxo principal de uma execução de batch."""
-    logger.info("=== Iniciando batch ===")
+async def execute_batch(
+    dry_run: bool = False,
+    refresh: bool = False,
+    transport: str = "live",
+    cassette: Path | None = None,
+    deadline: float | None = None,
+) -> int:
+    """Fluxo principal de uma execução de batch; retorna o número de arquivos baixados.
 
-    # 1. Autenticação
-    logger.info("Etapa 1/4: Autenticação")
-    token = await get_authenticated_session()
+    deadline (epoch) é o instante em que o batch deve parar (ver Daemon.run_batch).
+    """
+    # Uma sessão (pool de conexões) compartilhada por todas as etapas
+    async with Daemon(dry_run, refresh, transport, cassette) as daemon:
+        return await daemon.run_batch(deadline)
 
-    # 2. Preflight
-    logger.info("Etapa 2/4: Verificações pré-voo")
-    if not await preflight_check(token):
-        logger.error("Preflight falhou. Abortando batch.")
-        return
 
-    # 3. Descoberta
-    logger.info("Etapa 3/4: Descoberta de conteúdo")
-    items = await discover_media(token)
-    logger.info("%d itens encontrados no catálogo.", len(items))
-
-    if not items:
-        logger.info("Nenhum item para processar. Encerrando.")
-        return
+def _run_batch(**kwargs) -> int:
+    """Wrapper síncrono para execute_batch."""
+    return asyncio.run(execute_batch(**kwargs))
 
-    # 4. Download
-    logger.info("Etapa 4/4: Download")
-    downloaded = await download_batch(items, token, dry_run=dry_run)
-    logger.info("=== Batch concluído: %d arquivos baixados ===", len(downloaded))
 
-
-def _run_batch(dry_run: bool = False) -> None:
-    """Wrapper síncrono para execute_batch."""
-    asyncio.run(execute_batch(dry_run=dry_run))
+def _run_verify(workers: int) -> int:
+    """Executa `cof verify`; retorna o código de saída (1 se houver problemas)."""
+    with StateStore() as store:
+        report = verify_library(store, workers=workers)
+    return 1 if report.problems else 0
 
 
 def cli() -> None:
@@ -63,16 +59,78 @@ def cli() -> None:
     parser.add_argument(
         "--once",
         action="store_true",
-        help="Executa um único batch e encerra (ignora scheduler)",
+        help="Executa um único batch e encerra (sem isso, roda como daemon nas janelas de execução)",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Confere arquivos já baixados com GET condicional e baixa de novo os alterados "
+        "(no daemon, no primeiro batch e depois a cada REFRESH_INTERVAL)",
     )
+    parser.add_argument(
+        "--transport",
+        choices=TRANSPORT_MODES,
+        default="live",
+        help="live (rede), record (grava um cassette), replay (reproduz um cassette) "
+        "ou synthetic (catálogo gerado); replay e synthetic exigem COF_DATA_DIR",
+    )
+    parser.add_argument(
+        "--cassette",
+        type=Path,
+        help="Diretório do cassette para record/replay (padrão: cassettes/)",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    verify_parser = subparsers.add_parser(
+        "verify",
+        help="Re-hasheia o acervo e reporta arquivos ausentes, truncados ou modificados",
+    )
+    verify_parser.add_argument(
+        "--workers",
+        type=int,
+        default=VERIFY_WORKERS,
+        help=f"Processos para o cálculo de hash (padrão: {VERIFY_WORKERS})",
+    )
+    catalog_parser = subparsers.add_parser(
+        "catalog",
+        help="Consulta o catálogo salvo (com a situação dos downloads), sem acessar a rede",
+    )
+    catalog_parser.add_argument("--course", help="Id do curso ou parte do nome")
+    catalog_parser.add_argument("--type", help="Tipo de conteúdo (transcription, books, audios, videos)")
+    catalog_parser.add_argument(
+        "--lessons", type=parse_lessons, metavar="INÍCIO-FIM", help="Intervalo de aulas (ex.: 200-300)"
+    )
+    catalog_parser.add_argument(
+        "--status", choices=CATALOG_STATUSES, help="missing = ainda não baixado"
+    )
+    catalog_parser.add_argument("--search", help="Trecho do título")
+    catalog_parser.add_argument("--count", action="store_true", help="Mostra contagens por curso e tipo")
+    catalog_parser.add_argument("--limit", type=int, help="Número máximo de itens listados")
     args = parser.parse_args()
 
-    logger.info("COF iniciado (dry_run=%s, once=%s)", args.dry_run, args.once)
+    if args.command == "verify":
+        sys.exit(_run_verify(args.workers))
+    if args.command == "catalog":
+        sys.exit(run_catalog(args))
+
+    if args.transport in ("replay", "synthetic") and "COF_DATA_DIR" not in os.environ:
+        # Evita misturar estado e arquivos de teste com o acervo real
+        parser.error(f"--transport {args.transport} exige COF_DATA_DIR apontando para um diretório separado")
+
+    logger.info(
+        "COF iniciado (dry_run=%s, once=%s, refresh=%s, transport=%s)",
+        args.dry_run, args.once, args.refresh, args.transport,
+    )
 
+    batch_args = {
+        "dry_run": args.dry_run,
+        "refresh": args.refresh,
+        "transport": args.transport,
+        "cassette": args.cassette,
+    }
     if args.once:
-        _run_batch(dry_run=args.dry_run)
+        _run_batch(**batch_args)
     else:
-        run_scheduler(lambda: _run_batch(dry_run=args.dry_run))
+        asyncio.run(run_daemon(**batch_args))
 
 
 if __name__ == "__main__":
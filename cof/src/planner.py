@@ -0,0 +1,104 @@
+import logging
+
+from src.config import (
+    BATCH_MAX_BYTES,
+    BATCH_MAX_SECONDS,
+    BATCH_ORDER,
+    COURSES,
+    DEFAULT_SIZE_ESTIMATE,
+    ESTIMATED_RATE,
+    SIZE_ESTIMATES,
+    TYPE_PRIORITY,
+)
+from src.state import StateStore
+
+logger = logging.getLogger("cof.planner")
+
+# Chave de meta (state) com a vazão observada nos últimos batches (bytes/s)
+THROUGHPUT_KEY = "throughput"
+# Peso da medição mais recente na média móvel da vazão
+THROUGHPUT_ALPHA = 0.3
+
+_COURSE_ORDER = {name: i for i, (_, name) in enumerate(COURSES)}
+
+
+def estimate_size(item, store: StateStore) -> int:
+    """Tamanho do item: o registrado no estado, se houver; senão uma estimativa pelo tipo."""
+    row = store.get(item.media_url)
+    if row is not None and row["size"]:
+        return row["size"]
+    return SIZE_ESTIMATES.get(item.item_type, DEFAULT_SIZE_ESTIMATE)
+
+
+def queue_key(item, size: int, order: tuple[str, ...] = BATCH_ORDER) -> tuple:
+    """Chave de prioridade de um item na fila de downloads (menor = primeiro).
+
+    order combina os critérios "type", "size", "lesson" e "course".
+    """
+    keys = {
+        "type": lambda: (
+            TYPE_PRIORITY.index(item.item_type) if item.item_type in TYPE_PRIORITY else len(TYPE_PRIORITY)
+        ),
+        "size": lambda: size,
+        # Itens sem número de aula (0) vão para o fim
+        "lesson": lambda: item.lesson_number or float("inf"),
+        "course": lambda: (_COURSE_ORDER.get(item.course_name, len(_COURSE_ORDER)), item.course_name or ""),
+    }
+    return tuple(keys[name]() for name in order)
+
+
+def observed_rate(store: StateStore) -> float:
+    """Vazão usada no orçamento de tempo: a observada, ou ESTIMATED_RATE."""
+    value = store.get_meta(THROUGHPUT_KEY)
+    return float(value) if value else ESTIMATED_RATE
+
+
+def record_throughput(store: StateStore, nbytes: int, seconds: float) -> None:
+    """Atualiza a média móvel da vazão com a medição de um batch."""
+    if nbytes <= 0 or seconds <= 0:
+        return
+    measured = nbytes / seconds
+    previous = store.get_meta(THROUGHPUT_KEY)
+    rate = measured if previous is None else (
+        THROUGHPUT_ALPHA * measured + (1 - THROUGHPUT_ALPHA) * float(previous)
+    )
+    store.set_meta(THROUGHPUT_KEY, f"{rate:.0f}")
+    logger.debug("Vazão do batch: %.1f MB/s (média: %.1f MB/s)", measured / 2**20, rate / 2**20)
+
+
+class BatchBudget:
+    """Orçamento de bytes e tempo de um batch, consumido à medida que os itens saem da fila.
+
+    Um item que não cabe no orçamento restante é pulado em favor dos
+    seguintes (fica para o próximo batch); o primeiro item entra sempre,
+    para que arquivos maiores que o orçamento não fiquem parados para sempre.
+    """
+
+    def __init__(
+        self,
+        store: StateStore,
+        max_bytes: int = BATCH_MAX_BYTES,
+        max_seconds: float = BATCH_MAX_SECONDS,
+    ) -> None:
+        self.rate = observed_rate(store)
+        self.limit = min(max_bytes, int(max_seconds * self.rate))
+        self.planned = 0
+        self.accepted = 0
+        self.deferred = 0
+
+    def take(self, size: int) -> bool:
+        """Reserva size bytes do orçamento; False se o item fica para o próximo batch."""
+        if self.accepted and self.planned + size > self.limit:
+            self.deferred += 1
+            return False
+        self.planned += size
+        self.accepted += 1
+        return True
+
+    def log_summary(self, order: tuple[str, ...] = BATCH_ORDER) -> None:
+        logger.info(
+            "Batch: %d itens, ~%.0f MB de um orçamento de %.0f MB (%.1f MB/s estimados, "
+            "ordem %s); %d pendentes ficam para o próximo batch",
+            self.accepted, self.planned / 2**20, self.limit / 2**20, self.rate / 2**20,
+            ",".join(order), self.deferred,
+        )
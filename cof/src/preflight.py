@@ -1,12 +1,28 @@
+import asyncio
 import logging
 import random
+import shutil
+import tempfile
+import time
+from collections.abc import Callable
+from contextlib import nullcontext
 
 import httpx
 
-from src.config import API_BASE
+from src.config import (
+    API_BASE,
+    DATA_DIR,
+    PREFLIGHT_MIN_FREE_BYTES,
+    PREFLIGHT_TIMEOUT,
+    PREFLIGHT_TTL,
+)
+from src.state import StateStore
 
 logger = logging.getLogger("cof.preflight")
 
+# Chave em meta com o instante (epoch) do último preflight aprovado
+PREFLIGHT_KEY = "preflight_ok_at"
+
 USER_AGENTS = [
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
@@ -23,39 +39,111 @@ def get_random_ua() -> str:
     return random.choice(USER_AGENTS)
 
 
-def _auth_headers(token: str) -> dict[str, str]:
-    """Retorna headers de autenticação com JWT."""
-    return {
-        "Authorization": f"JWT {token}",
-        "User-Agent": get_random_ua(),
-    }
+def _disk_space() -> bool:
+    """DATA_DIR tem espaço livre para ao menos um batch inteiro."""
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    free = shutil.disk_usage(DATA_DIR).free
+    if free < PREFLIGHT_MIN_FREE_BYTES:
+        logger.warning(
+            "Pouco espaço em %s: %.1f MB livres (mínimo %.1f MB)",
+            DATA_DIR, free / 1e6, PREFLIGHT_MIN_FREE_BYTES / 1e6,
+        )
+        return False
+    return True
+
+
+def _data_dir_writable() -> bool:
+    """É possível criar arquivos em DATA_DIR."""
+    try:
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryFile(dir=DATA_DIR):
+            pass
+    except OSError as e:
+        logger.warning("Sem permissão de escrita em %s: %s", DATA_DIR, e)
+        return False
+    return True
+
+
+# Verificações locais (síncronas, executadas em threads) feitas a cada batch,
+# mesmo com o preflight remoto em cache. Para incluir outra, registre aqui.
+LOCAL_CHECKS: dict[str, Callable[[], bool]] = {
+    "disk_space": _disk_space,
+    "data_dir_writable": _data_dir_writable,
+}
+
+
+def _run_local_check(name: str, check: Callable[[], bool]) -> bool:
+    """Executa uma verificação local; erro de sistema de arquivos conta como falha."""
+    try:
+        return check()
+    except OSError as e:
+        logger.warning("Verificação %s falhou: %s", name, e)
+        return False
+
+
+async def _account_check(client: httpx.AsyncClient) -> dict[str, bool]:
+    r = await client.get(f"{API_BASE}/accounts/", timeout=PREFLIGHT_TIMEOUT)
+    return {"token_valid": r.status_code == 200, "not_rate_limited": "retry-after" not in r.headers}
 
 
-async def preflight_check(token: str) -> bool:
-    """Executa verificações pré-voo antes de iniciar um batch."""
-    checks = {
-        "token_valid": False,
-        "not_rate_limited": False,
-        "content_accessible": False,
-    }
+async def _content_check(client: httpx.AsyncClient) -> dict[str, bool]:
+    r = await client.get(f"{API_BASE}/courses/", timeout=PREFLIGHT_TIMEOUT)
+    return {"content_accessible": r.status_code == 200, "not_rate_limited": "retry-after" not in r.headers}
 
-    headers = _auth_headers(token)
 
-    async with httpx.AsyncClient(headers=headers, follow_redirects=True) as client:
+async def _remote_checks(client: httpx.AsyncClient, token_verified: bool) -> dict[str, bool]:
+    """Verificações na API, em paralelo; /accounts/ só se o token não foi confirmado."""
+    probes = [_content_check(client)]
+    if not token_verified:
+        probes.append(_account_check(client))
+    checks = {"token_valid": True}
+    for result in await asyncio.gather(*probes):
+        for name, ok in result.items():
+            checks[name] = checks.get(name, True) and ok
+    return checks
+
+
+def _cached_pass(store: StateStore) -> float | None:
+    """Idade (s) do último preflight remoto aprovado, se ainda dentro de PREFLIGHT_TTL."""
+    value = store.get_meta(PREFLIGHT_KEY)
+    age = time.time() - float(value) if value else None
+    return age if age is not None and 0 <= age < PREFLIGHT_TTL else None
+
+
+async def preflight_check(
+    client: httpx.AsyncClient, token_verified: bool = False, store: StateStore | None = None
+) -> bool:
+    """Executa verificações pré-voo antes de iniciar um batch.
+
+    client é o cliente da sessão, já autenticado (Session.api). As
+    verificações na API e as locais (LOCAL_CHECKS) correm em paralelo.
+    token_verified (ver TokenManager.verified) dispensa a consulta a
+    /accounts/. Um preflight remoto aprovado vale por PREFLIGHT_TTL: batches
+    seguidos nesse intervalo só repetem as verificações locais.
+
+    store reaproveita um estado já aberto (modo daemon); sem ele, um é aberto.
+    """
+    with nullcontext(store) if store is not None else StateStore() as store:
+        cached_age = _cached_pass(store)
+        probes = [asyncio.to_thread(_run_local_check, name, check) for name, check in LOCAL_CHECKS.items()]
+        if cached_age is None:
+            probes.append(_remote_checks(client, token_verified))
+
         try:
-            # Verificar token via endpoint de conta
-            r = await client.get(f"{API_BASE}/accounts/", timeout=30.0)
-            checks["token_valid"] = r.status_code == 200
-            checks["not_rate_limited"] = "retry-after" not in r.headers
-
-            # Verificar acesso ao conteúdo do curso
-            r2 = await client.get(f"{API_BASE}/courses/", timeout=30.0)
-            checks["content_accessible"] = r2.status_code == 200
+            results = await asyncio.gather(*probes)
         except httpx.HTTPError as e:
             logger.error("Erro no preflight: %s", e)
             return False
 
-    all_ok = all(checks.values())
+        checks = dict(zip(LOCAL_CHECKS, results))
+        if cached_age is None:
+            checks.update(results[-1])
+        all_ok = all(checks.values())
+        if all_ok and cached_age is None:
+            store.set_meta(PREFLIGHT_KEY, str(time.time()))
+
+    if cached_age is not None:
+        logger.info("Preflight da API em cache (aprovado há %.0fs)", cached_age)
     if all_ok:
         logger.info("Preflight OK: %s", checks)
     else:
@@ -0,0 +1,344 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import httpx
+
+from src.bandwidth import TokenBucket
+from src.config import (
+    CIRCUIT_COOLDOWN,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_MAX_WAIT,
+    DEFAULT_HOST_CONCURRENCY,
+    DEFAULT_HOST_MIN_INTERVAL,
+    HOST_CONCURRENCY,
+    HOST_MIN_INTERVAL,
+    RETRY_ATTEMPTS,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    RETRY_STATUSES,
+)
+
+logger = logging.getLogger("cof.resilience")
+
+# Métodos que podem ser repetidos sem efeitos colaterais
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+class CircuitOpenError(httpx.TransportError):
+    """O host está com o circuito aberto (falhas seguidas) por mais tempo que CIRCUIT_MAX_WAIT."""
+
+
+def retry_after_seconds(value: str | None) -> float | None:
+    """Interpreta o header Retry-After (segundos ou data HTTP)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int) -> float:
+    """Backoff exponencial com jitter completo: uniforme em [0, base * 2**attempt]."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+
+
+class CircuitBreaker:
+    """Circuit breaker por host.
+
+    Após CIRCUIT_FAILURE_THRESHOLD falhas seguidas (429, 5xx ou erro de
+    conexão) o circuito do host abre por CIRCUIT_COOLDOWN segundos (ou pelo
+    Retry-After, se maior). Enquanto aberto, novas requisições aguardam a
+    reabertura em vez de martelar o host; se a espera passar de
+    CIRCUIT_MAX_WAIT, falham com CircuitOpenError. Passado o cooldown o
+    circuito fica meio aberto: só uma requisição de teste segue, e as demais
+    aguardam o resultado dela. Sucesso fecha o circuito, falha o abre de novo.
+    """
+
+    def __init__(
+        self,
+        threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        cooldown: float = CIRCUIT_COOLDOWN,
+        max_wait: float = CIRCUIT_MAX_WAIT,
+    ) -> None:
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._max_wait = max_wait
+        self._failures: dict[str, int] = {}
+        self._open_until: dict[str, float] = {}
+        # Meio aberto: requisição de teste em andamento por host
+        self._probes: dict[str, asyncio.Event] = {}
+
+    def remaining(self, host: str) -> float:
+        """Segundos até o circuito do host fechar (0 se fechado)."""
+        return max(0.0, self._open_until.get(host, 0.0) - time.monotonic())
+
+    async def wait(self, host: str) -> asyncio.Event | None:
+        """Aguarda o circuito do host liberar a requisição (ou levanta CircuitOpenError).
+
+        Retorna o marcador da requisição de teste quando ela é a escolhida no
+        circuito meio aberto (ver release), ou None.
+        """
+        while True:
+            remaining = self.remaining(host)
+            if remaining > 0:
+                if remaining > self._max_wait:
+                    raise CircuitOpenError(f"Circuito aberto para {host} por mais {remaining:.0f}s")
+                logger.debug("Circuito aberto para %s, aguardando %.1fs", host, remaining)
+                await asyncio.sleep(remaining)
+                continue
+            if host not in self._open_until:
+                return None
+            probe = self._probes.get(host)
+            if probe is None:
+                logger.info("Circuito meio aberto para %s, enviando requisição de teste", host)
+                probe = self._probes[host] = asyncio.Event()
+                return probe
+            await probe.wait()
+
+    def release(self, host: str, probe: asyncio.Event | None) -> None:
+        """Encerra a requisição de teste que terminou sem resultado (ex.: cancelada)."""
+        if probe is not None and self._probes.get(host) is probe:
+            del self._probes[host]
+            probe.set()
+
+    def success(self, host: str) -> None:
+        if self._failures.pop(host, 0) >= self._threshold:
+            logger.info("Circuito fechado para %s", host)
+        self._open_until.pop(host, None)
+        self.release(host, self._probes.get(host))
+
+    def failure(self, host: str, retry_after: float | None = None) -> None:
+        failures = self._failures.get(host, 0) + 1
+        self._failures[host] = failures
+        if failures < self._threshold:
+            return
+        cooldown = max(self._cooldown, retry_after or 0.0)
+        self._open_until[host] = time.monotonic() + cooldown
+        self.release(host, self._probes.get(host))
+        logger.warning(
+            "Circuito aberto para %s após %d falhas seguidas (pausa de %.0fs)", host, failures, cooldown
+        )
+
+
+class HostLimiter:
+    """Limita concorrência e ritmo de requisições por host.
+
+    Cada host tem seu próprio semáforo (conexões simultâneas) e um relógio de
+    pacing que garante um intervalo mínimo entre o início de duas requisições.
+    A banda total é limitada por um token bucket compartilhado por todos os
+    downloads que usam o mesmo limiter.
+
+    A Session mantém um único limiter (Session.limiter), compartilhado pela
+    API (HostLimitedTransport) e pelos downloads, e que no daemon preserva o
+    pacing entre batches seguidos.
+    """
+
+    def __init__(
+        self,
+        concurrency: dict[str, int] | None = None,
+        min_interval: dict[str, float] | None = None,
+        default_concurrency: int = DEFAULT_HOST_CONCURRENCY,
+        default_min_interval: float = DEFAULT_HOST_MIN_INTERVAL,
+        bandwidth: TokenBucket | None = None,
+    ) -> None:
+        self.bandwidth = bandwidth or TokenBucket()
+        self._concurrency = dict(HOST_CONCURRENCY if concurrency is None else concurrency)
+        self._min_interval = dict(HOST_MIN_INTERVAL if min_interval is None else min_interval)
+        self._default_concurrency = default_concurrency
+        self._default_min_interval = default_min_interval
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._pace_locks: dict[str, asyncio.Lock] = {}
+        self._next_start: dict[str, float] = {}
+        # Medição de vazão: bytes recebidos e tempo com ao menos uma transferência ativa
+        self.received = 0
+        self._active = 0
+        self._busy = 0.0
+        self._busy_since = 0.0
+
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self._semaphores:
+            limit = self._concurrency.get(host, self._default_concurrency)
+            self._semaphores[host] = asyncio.Semaphore(max(1, limit))
+        return self._semaphores[host]
+
+    async def _pace(self, host: str) -> None:
+        """Aguarda até que o próximo início de requisição ao host seja permitido."""
+        interval = self._min_interval.get(host, self._default_min_interval)
+        if interval <= 0:
+            return
+        lock = self._pace_locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            loop = asyncio.get_running_loop()
+            wait = self._next_start.get(host, 0.0) - loop.time()
+            if wait > 0:
+                logger.debug("Pacing %s: aguardando %.1fs", host, wait)
+                await asyncio.sleep(wait)
+            self._next_start[host] = loop.time() + interval
+
+    @property
+    def busy_seconds(self) -> float:
+        """Tempo acumulado com ao menos uma transferência em andamento.
+
+        Só conta o intervalo dentro de transfer(): a espera pelo slot e o
+        pacing entre requisições ficam de fora.
+        """
+        if self._active:
+            return self._busy + time.monotonic() - self._busy_since
+        return self._busy
+
+    async def throttle(self, nbytes: int) -> None:
+        """Debita nbytes recebidos do limite global de banda."""
+        self.received += nbytes
+        await self.bandwidth.consume(nbytes)
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        """Reserva uma conexão para o host da URL, respeitando o pacing."""
+        host = urlparse(url).hostname or ""
+        async with self._semaphore(host):
+            await self._pace(host)
+            yield
+
+    @asynccontextmanager
+    async def transfer(self, url: str):
+        """slot() de um download: o tempo com o slot reservado entra em busy_seconds."""
+        async with self.slot(url):
+            if not self._active:
+                self._busy_since = time.monotonic()
+            self._active += 1
+            try:
+                yield
+            finally:
+                self._active -= 1
+                if not self._active:
+                    self._busy += time.monotonic() - self._busy_since
+
+
+class _SlotStream(httpx.AsyncByteStream):
+    """Repassa o corpo da resposta e libera o slot do host quando ele é fechado."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, slot: AsyncExitStack) -> None:
+        self._stream = stream
+        self._slot = slot
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            await self._slot.aclose()
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """Transport httpx que passa cada requisição pelo HostLimiter.
+
+    Usado no cliente da API, cujas requisições (descoberta, fingerprints,
+    preflight) não passam pelo downloader: a concorrência e o pacing de
+    HOST_CONCURRENCY/HOST_MIN_INTERVAL valem também para elas. O slot do
+    host fica reservado até o corpo da resposta ser fechado.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limiter: HostLimiter) -> None:
+        self._transport = transport
+        self._limiter = limiter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        slot = AsyncExitStack()
+        await slot.enter_async_context(self._limiter.slot(str(request.url)))
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            await slot.aclose()
+            raise
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_SlotStream(response.stream, slot),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    """Transport httpx com retentativas e circuit breaker por host.
+
+    Requisições idempotentes que falham por erro de conexão ou com status
+    em RETRY_STATUSES são repetidas com backoff exponencial e jitter,
+    respeitando o Retry-After do servidor. As respostas repassadas ao
+    cliente ainda não tiveram o corpo lido, então downloads em streaming
+    funcionam normalmente.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, breaker: CircuitBreaker | None = None) -> None:
+        self._transport = transport
+        self._breaker = breaker or CircuitBreaker()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        retryable = request.method in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            # A cada tentativa: com o circuito meio aberto, só a de teste segue
+            probe = await self._breaker.wait(host)
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                self._breaker.failure(host)
+                delay = self._retry_delay(host, retryable, attempt)
+                if delay is None:
+                    raise
+                logger.warning(
+                    "%s %s: %s — nova tentativa em %.1fs", request.method, request.url, e, delay
+                )
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self._breaker.success(host)
+                    return response
+                retry_after = retry_after_seconds(response.headers.get("retry-after"))
+                self._breaker.failure(host, retry_after)
+                delay = self._retry_delay(host, retryable, attempt, retry_after)
+                if delay is None:
+                    return response
+                await response.aclose()
+                logger.warning(
+                    "%s %s: HTTP %d — nova tentativa em %.1fs",
+                    request.method, request.url, response.status_code, delay,
+                )
+            finally:
+                self._breaker.release(host, probe)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _retry_delay(
+        self, host: str, retryable: bool, attempt: int, retry_after: float | None = None
+    ) -> float | None:
+        """Espera até a próxima tentativa, ou None se não vale a pena repetir.
+
+        A espera é o Retry-After (ou o backoff), estendida até o circuito do
+        host fechar; se passar de RETRY_MAX_DELAY a falha é devolvida a quem
+        chamou, em vez de prender o worker.
+        """
+        if not retryable or attempt + 1 >= RETRY_ATTEMPTS:
+            return None
+        delay = retry_after if retry_after is not None else backoff_delay(attempt)
+        delay = max(delay, self._breaker.remaining(host))
+        return None if delay > RETRY_MAX_DELAY else delay
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
@@ -1,48 +1,111 @@
+import asyncio
 import logging
-import time
-from datetime import datetime
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta
+from datetime import time as dtime
+from typing import NamedTuple
 
-import schedule
-
-from src.config import EXECUTION_WINDOWS
+from src.config import EXECUTION_WINDOWS, SCHEDULER_IDLE_WAIT, SCHEDULER_MAX_SLEEP
 
 logger = logging.getLogger("cof.scheduler")
 
 
-def is_within_window() -> bool:
-    """Verifica se o horário atual está dentro de uma janela de execução."""
-    now = datetime.now().time()
-    for start_str, end_str in EXECUTION_WINDOWS:
-        start = datetime.strptime(start_str, "%H:%M").time()
-        end = datetime.strptime(end_str, "%H:%M").time()
-        if start <= now <= end:
-            return True
-    return False
+class Window(NamedTuple):
+    """Janela de execução já interpretada."""
+
+    start: dtime
+    end: dtime  # fim <= início: a janela cruza a meia-noite
+    bandwidth: int | None  # limite de banda (bytes/s) durante a janela; None = sem limite
+
+
+def parse_windows(windows: list[tuple]) -> list[Window]:
+    """Converte entradas ("HH:MM", "HH:MM"[, limite de banda]) de EXECUTION_WINDOWS."""
+    return [
+        Window(
+            datetime.strptime(start, "%H:%M").time(),
+            datetime.strptime(end, "%H:%M").time(),
+            bandwidth[0] if bandwidth else None,
+        )
+        for start, end, *bandwidth in windows
+    ]
+
+
+# Interpretadas uma vez, e não a cada verificação
+WINDOWS = parse_windows(EXECUTION_WINDOWS)
 
 
-def run_scheduler(execute_fn) -> None:
+def current_window(now: datetime, windows: list[Window] = WINDOWS) -> tuple[Window, datetime] | None:
+    """Janela de execução aberta em now e o instante em que ela fecha, ou None."""
+    for window in windows:
+        # A janela aberta pode ter começado ontem (ex.: 23:00-01:00)
+        for day in (now.date() - timedelta(days=1), now.date()):
+            opens = datetime.combine(day, window.start)
+            closes_day = day if window.end > window.start else day + timedelta(days=1)
+            closes = datetime.combine(closes_day, window.end)
+            if opens <= now < closes:
+                return window, closes
+    return None
+
+
+def window_end(now: datetime, windows: list[Window] = WINDOWS) -> datetime | None:
+    """Fim da janela de execução aberta em now, ou None se nenhuma está aberta."""
+    match = current_window(now, windows)
+    return match[1] if match else None
+
+
+def next_window_start(now: datetime, windows: list[Window] = WINDOWS) -> datetime:
+    """Próximo início de janela depois de now."""
+    return min(
+        opens
+        for start, *_ in windows
+        for day in (now.date(), now.date() + timedelta(days=1))
+        if (opens := datetime.combine(day, start)) > now
+    )
+
+
+async def _sleep_until(target: datetime) -> None:
+    """Dorme até target, acordando no máximo a cada SCHEDULER_MAX_SLEEP segundos.
+
+    O limite protege contra saltos do relógio (suspensão da máquina, NTP): a
+    espera restante é recalculada pelo relógio de parede a cada despertar.
+    """
+    while (remaining := (target - datetime.now()).total_seconds()) > 0:
+        await asyncio.sleep(min(remaining, SCHEDULER_MAX_SLEEP))
+
+
+async def run_scheduler(execute_fn: Callable[[float], Awaitable[int | None]]) -> None:
     """Executa o agendador que chama execute_fn dentro das janelas permitidas.
 
+    Fora das janelas o processo dorme até o próximo início. Com a janela
+    aberta, os batches rodam um após o outro, cada um recebendo como deadline
+    o fim da janela; um batch sem downloads (nada pendente ou falha) espera
+    SCHEDULER_IDLE_WAIT antes do próximo, para não consultar a API à toa.
+
+    Todos os batches rodam no mesmo event loop (ver src/daemon.py).
+
     Args:
-        execute_fn: Função síncrona que executa um batch (deve chamar asyncio.run internamente).
+        execute_fn: Corotina que executa um batch. Recebe o deadline (epoch)
+            e retorna o número de arquivos baixados.
     """
-    def _check_and_run():
-        if is_within_window():
-            logger.info("Dentro da janela de execução, iniciando batch...")
-            try:
-                execute_fn()
-            except Exception as e:
-                logger.error("Erro durante execução do batch: %s", e)
-        else:
-            logger.debug("Fora da janela de execução, aguardando...")
-
-    schedule.every(5).minutes.do(_check_and_run)
-
     logger.info(
         "Scheduler iniciado. Janelas de execução: %s",
-        [f"{s}-{e}" for s, e in EXECUTION_WINDOWS],
+        [f"{s}-{e}" for s, e, *_ in EXECUTION_WINDOWS],
     )
 
     while True:
-        schedule.run_pending()
-        time.sleep(60)
+        now = datetime.now()
+        end = window_end(now)
+        if end is None:
+            start = next_window_start(now)
+            logger.info("Fora da janela de execução, próximo início às %s", start.strftime("%Y-%m-%d %H:%M"))
+            await _sleep_until(start)
+            continue
+
+        logger.info("Dentro da janela de execução (até %s), iniciando batch...", end.strftime("%H:%M"))
+        try:
+            downloaded = await execute_fn(end.timestamp())
+        except Exception as e:
+            logger.error("Erro durante execução do batch: %s", e)
+            downloaded = 0
+        if not downloaded:
+            await _sleep_until(min(end, datetime.now() + timedelta(seconds=SCHEDULER_IDLE_WAIT)))
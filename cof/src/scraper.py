@@ -1,11 +1,23 @@
+import asyncio
+import json
 import logging
-from dataclasses import dataclass
+import time
+from collections.abc import AsyncIterator
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
 from urllib.parse import urlparse
 
 import httpx
 
-from src.config import API_BASE, COURSES
-from src.preflight import get_random_ua
+from src.config import (
+    API_BASE,
+    CATALOG_MAX_AGE,
+    CATALOG_TTL,
+    COURSES,
+    DISCOVERY_CONCURRENCY,
+    PAGINATION_CONCURRENCY,
+)
+from src.state import StateStore
 
 logger = logging.getLogger("cof.scraper")
 
@@ -29,101 +41,276 @@ def _extract_extension(url: str) -> str:
     return "bin"
 
 
-async def _fetch_paginated(client: httpx.AsyncClient, url: str, params: dict | None = None) -> list[dict]:
-    """Busca todos os resultados de um endpoint paginado."""
-    all_results = []
+async def _gather_all(*coros) -> list:
+    """Executa as corotinas em paralelo; na primeira falha cancela as demais.
+
+    Como asyncio.TaskGroup, mas levanta a exceção original em vez do
+    ExceptionGroup, preservando o tratamento de erro dos chamadores.
+    """
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(c) for c in coros]
+    except ExceptionGroup as eg:
+        raise eg.exceptions[0] from None
+    return [t.result() for t in tasks]
+
+
+async def _fetch_page(client: httpx.AsyncClient, url: str, params: dict) -> dict:
+    r = await client.get(url, params=params)
+    r.raise_for_status()
+    return r.json()
+
+
+async def iter_pages(
+    client: httpx.AsyncClient,
+    url: str,
+    params: dict | None = None,
+    concurrency: int = PAGINATION_CONCURRENCY,
+) -> AsyncIterator[list[dict]]:
+    """Itera, em ordem, os resultados de cada página de um endpoint paginado.
+
+    O count da primeira página determina os offsets restantes, que são
+    buscados em paralelo (até concurrency por vez); cada página é entregue
+    assim que ela e as anteriores chegam. Sem count, as páginas são
+    percorridas em sequência pelo campo next.
+    """
     params = dict(params or {})
     params.setdefault("limit", 100)
     params.setdefault("offset", 0)
 
-    while True:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        data = r.json()
-        results = data.get("results", [])
-        all_results.extend(results)
+    data = await _fetch_page(client, url, params)
+    first = data.get("results", [])
+    yield first
+    if not data.get("next"):
+        return
 
-        if not data.get("next"):
-            break
-        params["offset"] += params["limit"]
+    # O servidor pode limitar o tamanho da página abaixo do limit pedido
+    step = min(params["limit"], len(first)) or params["limit"]
+    offset = params["offset"] + step
+    count = data.get("count")
 
-    return all_results
+    if isinstance(count, int) and offset < count:
+        semaphore = asyncio.Semaphore(max(1, concurrency))
 
+        async def fetch(page_offset: int) -> dict:
+            async with semaphore:
+                return await _fetch_page(client, url, {**params, "offset": page_offset})
 
-async def _discover_course(client: httpx.AsyncClient, course_id: int, course_name: str) -> list[MediaItem]:
-    """Descobre itens de mídia com download direto para um curso."""
-    items: list[MediaItem] = []
+        offsets = range(offset, count, step)
+        tasks = [asyncio.create_task(fetch(o)) for o in offsets]
+        try:
+            for task in tasks:
+                data = await task
+                yield data.get("results", [])
+        finally:
+            # Falha ou consumidor interrompido: cancela as páginas restantes
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        # Itens incluídos durante a busca: o restante segue pelo next
+        offset = offsets[-1] + step
+
+    while data.get("next"):
+        data = await _fetch_page(client, url, {**params, "offset": offset})
+        yield data.get("results", [])
+        offset += step
+
+
+async def fetch_paginated(
+    client: httpx.AsyncClient,
+    url: str,
+    params: dict | None = None,
+    concurrency: int = PAGINATION_CONCURRENCY,
+) -> list[dict]:
+    """Busca todos os resultados de um endpoint paginado (ver iter_pages)."""
+    return [r async for page in iter_pages(client, url, params, concurrency) for r in page]
+
+
+def _media_item(source: dict, lesson_map: dict, course_name: str) -> MediaItem | None:
+    """Converte um source da API em MediaItem; None se não tem download direto."""
+    file_url = source.get("file")
+    if not file_url:
+        return None
+
+    lesson_info = lesson_map.get(source.get("lesson"), {})
+    return MediaItem(
+        title=source.get("name", "Sem título"),
+        lesson_number=lesson_info.get("number", 0),
+        media_url=file_url,
+        extension=_extract_extension(file_url),
+        item_type=source.get("category_key", "other"),
+        course_name=course_name,
+        category=source.get("category"),
+    )
+
+
+async def _iter_course(
+    client: httpx.AsyncClient, course_id: int, course_name: str
+) -> AsyncIterator[list[MediaItem]]:
+    """Itera os itens com download direto de um curso, uma página de sources por vez.
 
-    # Buscar lessons (para mapear lesson_id -> número)
-    lessons = await _fetch_paginated(
-        client, f"{API_BASE}/courses/lessons/{course_id}", {"sort": "asc"}
+    As lessons (para mapear lesson_id -> número) são buscadas em paralelo
+    com a primeira página de sources.
+    """
+    lessons_task = asyncio.create_task(
+        fetch_paginated(client, f"{API_BASE}/courses/lessons/{course_id}", {"sort": "asc"})
     )
-    lesson_map = {l["id"]: l for l in lessons}
-    logger.info("  %s: %d aulas", course_name, len(lessons))
+    lesson_map = None
+    n_sources = 0
+    try:
+        async for sources in iter_pages(client, f"{API_BASE}/courses/sources/{course_id}"):
+            if lesson_map is None:
+                lesson_map = {l["id"]: l for l in await lessons_task}
+            n_sources += len(sources)
+            page = [_media_item(s, lesson_map, course_name) for s in sources]
+            yield [item for item in page if item is not None]
+    finally:
+        lessons_task.cancel()
+        await asyncio.gather(lessons_task, return_exceptions=True)
+    logger.info("  %s: %d aulas, %d sources", course_name, len(lesson_map or {}), n_sources)
 
-    # Buscar sources
-    sources = await _fetch_paginated(
-        client, f"{API_BASE}/courses/sources/{course_id}"
+
+async def _listing_fingerprint(client: httpx.AsyncClient, url: str, params: dict | None = None) -> dict:
+    """Resumo barato de uma listagem: count, id do primeiro item e ETag (página de 1 item)."""
+    r = await client.get(url, params={**(params or {}), "limit": 1, "offset": 0})
+    r.raise_for_status()
+    data = r.json()
+    results = data.get("results") or []
+    return {
+        "count": data.get("count"),
+        "first": results[0].get("id") if results else None,
+        "etag": r.headers.get("etag"),
+    }
+
+
+async def _course_fingerprint(client: httpx.AsyncClient, course_id: int) -> str:
+    """Fingerprint de um curso: muda quando aulas ou sources são incluídas ou removidas."""
+    lessons, sources = await _gather_all(
+        # Ordem decrescente: o primeiro item é a aula/source mais nova
+        _listing_fingerprint(client, f"{API_BASE}/courses/lessons/{course_id}", {"sort": "desc"}),
+        _listing_fingerprint(client, f"{API_BASE}/courses/sources/{course_id}", {"sort": "desc"}),
     )
-    logger.info("  %s: %d sources", course_name, len(sources))
-
-    for source in sources:
-        # Apenas itens com download direto (file preenchido)
-        file_url = source.get("file")
-        if not file_url:
-            continue
-
-        category_key = source.get("category_key", "other")
-        name = source.get("name", "Sem título")
-        lesson_id = source.get("lesson")
-        lesson_info = lesson_map.get(lesson_id, {})
-        lesson_number = lesson_info.get("number", 0)
-
-        items.append(MediaItem(
-            title=name,
-            lesson_number=lesson_number,
-            media_url=file_url,
-            extension=_extract_extension(file_url),
-            item_type=category_key,
+    return json.dumps({"lessons": lessons, "sources": sources}, sort_keys=True)
+
+
+def _cached_items(store: StateStore, course_id: int, course_name: str) -> list[MediaItem]:
+    return [
+        MediaItem(
+            title=row["title"],
+            lesson_number=row["lesson_number"],
+            media_url=row["url"],
+            extension=row["extension"],
+            item_type=row["item_type"],
             course_name=course_name,
-            category=source.get("category"),
-        ))
+            category=row["category"],
+        )
+        for row in store.catalog_items(course_id)
+    ]
 
-    return items
 
+async def _iter_course_cached(
+    client: httpx.AsyncClient, store: StateStore, course_id: int, course_name: str
+) -> AsyncIterator[list[MediaItem]]:
+    """Itera um curso reaproveitando o snapshot salvo quando ele ainda vale.
 
-async def discover_media(token: str) -> list[MediaItem]:
-    """Descobre URLs de mídia disponíveis via API REST para todos os cursos."""
-    all_items: list[MediaItem] = []
+    - snapshot conferido há menos de CATALOG_TTL: usado sem acessar a API;
+    - fingerprint igual ao salvo: snapshot reaproveitado (2 requisições de 1 item);
+    - fingerprint diferente ou snapshot mais velho que CATALOG_MAX_AGE: busca
+      completa, entregue página a página e salva como novo snapshot ao final.
 
-    headers = {
-        "Authorization": f"JWT {token}",
-        "User-Agent": get_random_ua(),
-    }
+    Se a API estiver indisponível, o snapshot salvo é usado, por mais velho que
+    seja (itens já entregues antes da falha são repetidos; a deduplicação de
+    iter_media os descarta).
+    """
+    row = store.catalog_course(course_id)
+    now = time.time()
+    if row is not None and now - row["checked_at"] < CATALOG_TTL:
+        items = _cached_items(store, course_id, course_name)
+        logger.info("  %s: %d itens do catálogo salvo", course_name, len(items))
+        yield items
+        return
+
+    items: list[MediaItem] = []
+    try:
+        fingerprint = await _course_fingerprint(client, course_id)
+        if (
+            row is not None
+            and row["fingerprint"] == fingerprint
+            and now - row["fetched_at"] < CATALOG_MAX_AGE
+        ):
+            store.mark_catalog_checked(course_id)
+            items = _cached_items(store, course_id, course_name)
+            logger.info("  %s: catálogo inalterado (%d itens)", course_name, len(items))
+            yield items
+            return
+        async for page in _iter_course(client, course_id, course_name):
+            items.extend(page)
+            yield page
+    except httpx.HTTPError as e:
+        if row is None:
+            raise
+        cached = _cached_items(store, course_id, course_name)
+        logger.warning(
+            "  %s: API indisponível (%s), usando catálogo salvo de %s (%d itens)",
+            course_name, e, time.strftime("%Y-%m-%d %H:%M", time.localtime(row["fetched_at"])), len(cached),
+        )
+        yield cached
+        return
+
+    store.save_catalog(course_id, course_name, fingerprint, [asdict(item) for item in items])
+
+
+async def iter_media(
+    client: httpx.AsyncClient,
+    courses: list[tuple[int, str]] = COURSES,
+    concurrency: int = DISCOVERY_CONCURRENCY,
+    store: StateStore | None = None,
+) -> AsyncIterator[MediaItem]:
+    """Descobre, via API REST, as mídias de todos os cursos, entregando-as à medida que chegam.
 
-    logger.info("Iniciando descoberta de conteúdo (%d cursos)", len(COURSES))
+    client é o cliente da sessão, já autenticado (Session.api). Os cursos são
+    percorridos em paralelo (até concurrency por vez) e cada página de sources
+    é entregue assim que chega, já deduplicada por URL, de modo que o
+    consumidor (download_batch) começa a trabalhar antes do fim da descoberta.
+    A falha de um curso é registrada e não afeta os demais. Cursos cujo
+    catálogo não mudou são servidos do snapshot salvo no estado (store, se
+    informado, ou um StateStore aberto para a descoberta).
+    """
+    logger.info("Iniciando descoberta de conteúdo (%d cursos)", len(courses))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    # Páginas prontas aguardando o consumidor (backpressure sobre a descoberta)
+    pages: asyncio.Queue = asyncio.Queue(maxsize=max(1, concurrency) * 2)
 
-    async with httpx.AsyncClient(headers=headers, follow_redirects=True, timeout=30.0) as client:
-        for course_id, course_name in COURSES:
+    with nullcontext(store) if store is not None else StateStore() as store:
+
+        async def discover(course_id: int, course_name: str) -> None:
+            async with semaphore:
+                try:
+                    async for page in _iter_course_cached(client, store, course_id, course_name):
+                        await pages.put(page)
+                except Exception as e:
+                    logger.error("Erro ao descobrir curso %s (id=%d): %s", course_name, course_id, e)
+
+        async def run() -> None:
             try:
-                items = await _discover_course(client, course_id, course_name)
-                all_items.extend(items)
-            except Exception as e:
-                logger.error("Erro ao descobrir curso %s (id=%d): %s", course_name, course_id, e)
-
-    # Deduplicar por URL
-    seen = set()
-    unique_items = []
-    for item in all_items:
-        if item.media_url not in seen:
-            seen.add(item.media_url)
-            unique_items.append(item)
-
-    # Estatísticas
-    by_type = {}
-    for item in unique_items:
-        by_type.setdefault(item.item_type, 0)
-        by_type[item.item_type] += 1
-    logger.info("Descoberta concluída: %d itens com download direto — %s", len(unique_items), by_type)
-
-    return unique_items
+                await asyncio.gather(*(discover(cid, name) for cid, name in courses))
+            finally:
+                await pages.put(None)
+
+        runner = asyncio.create_task(run())
+        seen: set[str] = set()
+        by_type: dict[str, int] = {}
+        try:
+            while (page := await pages.get()) is not None:
+                for item in page:
+                    if item.media_url in seen:
+                        continue
+                    seen.add(item.media_url)
+                    by_type[item.item_type] = by_type.get(item.item_type, 0) + 1
+                    yield item
+            await runner
+        finally:
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+    logger.info("Descoberta concluída: %d itens com download direto — %s", len(seen), by_type)
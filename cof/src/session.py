@@ -0,0 +1,106 @@
+import logging
+
+import httpx
+
+from src.config import (
+    HTTP2,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE,
+    HTTP_READ_TIMEOUT,
+    HTTP_TIMEOUT,
+)
+from src.auth import JWTAuth, TokenManager
+from src.preflight import get_random_ua
+from src.resilience import CircuitBreaker, HostLimitedTransport, HostLimiter, ResilientTransport
+
+logger = logging.getLogger("cof.session")
+
+
+def _http2_available() -> bool:
+    """HTTP/2 no httpx depende do pacote opcional h2 (httpx[http2])."""
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.debug("Pacote h2 não instalado, usando HTTP/1.1")
+        return False
+    return True
+
+
+class Session:
+    """Clientes HTTP compartilhados por todas as etapas de um batch.
+
+    Um único objeto é criado por batch e repassado a autenticação, preflight,
+    descoberta e download, de modo que DNS, TCP e TLS são negociados uma vez
+    e as conexões são reaproveitadas entre as etapas.
+
+    - api: cliente HTTP/2 (quando disponível) para a API, multiplexando as
+      requisições da descoberta numa única conexão;
+    - files: cliente HTTP/1.1 para arquivos, em que cada download/segmento
+      usa sua própria conexão TCP (em HTTP/2 os segmentos disputariam uma só).
+
+    O header de autenticação é gerenciado aqui, para os dois clientes. Os dois
+    passam pelo ResilientTransport (retentativas e circuit breaker por host),
+    com um único breaker compartilhado. limiter (concorrência, pacing e banda
+    por host) também é único: a API passa por ele no transport
+    (HostLimitedTransport) e os downloads o recebem do chamador (ver
+    download_batch).
+
+    transport substitui a rede nos dois clientes (ver src/transport.py:
+    gravação, replay de cassettes e catálogo sintético).
+    """
+
+    def __init__(self, token: str | None = None, transport: httpx.AsyncBaseTransport | None = None) -> None:
+        self._transport = transport
+        self.breaker = CircuitBreaker()
+        self.limiter = HostLimiter()
+        self.user_agent = get_random_ua()
+        self.api = self._client(http2=_http2_available(), limited=True)
+        # Os downloads reservam o slot do host por conta própria (download_file)
+        self.files = self._client(http2=False, limited=False)
+        self.token: str | None = None
+        if token:
+            self.set_token(token)
+
+    def _client(self, http2: bool, limited: bool) -> httpx.AsyncClient:
+        transport = self._transport or httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+        if limited:
+            # Dentro das retentativas: cada tentativa respeita o pacing do host
+            transport = HostLimitedTransport(transport, self.limiter)
+        return httpx.AsyncClient(
+            transport=ResilientTransport(transport, self.breaker),
+            headers={"User-Agent": self.user_agent},
+            follow_redirects=True,
+            timeout=httpx.Timeout(HTTP_TIMEOUT, read=HTTP_READ_TIMEOUT),
+        )
+
+    def set_token(self, token: str) -> None:
+        """Define um token JWT fixo enviado por todas as requisições da sessão."""
+        self.token = token
+        for client in (self.api, self.files):
+            client.headers["Authorization"] = f"JWT {token}"
+
+    def set_auth(self, tokens: TokenManager) -> None:
+        """Autentica a sessão com o token corrente de um TokenManager (renovado em 401)."""
+        auth = JWTAuth(tokens)
+        for client in (self.api, self.files):
+            client.auth = auth
+
+    async def aclose(self) -> None:
+        await self.api.aclose()
+        await self.files.aclose()
+
+    async def __aenter__(self) -> "Session":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
@@ -0,0 +1,400 @@
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+
+from src.config import DATA_DIR, EXTRA_DIR, STATE_DB, STATE_FILE
+
+logger = logging.getLogger("cof.state")
+
+# Escopos: quem registrou o item
+SCOPE_COF = "cof"
+SCOPE_EXTRA = "extra"
+SCOPE_AUDIOS = "audios"
+
+# Status de um item
+STATUS_DOWNLOADING = "downloading"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# Cada entrada leva o schema da versão N-1 para N (PRAGMA user_version)
+MIGRATIONS = [
+    """
+    CREATE TABLE items (
+        url TEXT PRIMARY KEY,
+        scope TEXT NOT NULL,
+        status TEXT NOT NULL,
+        path TEXT,
+        size INTEGER,
+        sha256 TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX idx_items_scope_status ON items(scope, status);
+    CREATE TABLE meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """,
+    """
+    ALTER TABLE items ADD COLUMN etag TEXT;
+    CREATE INDEX idx_items_etag_size ON items(etag, size);
+    """,
+    """
+    ALTER TABLE items ADD COLUMN last_modified TEXT;
+    ALTER TABLE items ADD COLUMN checked_at REAL;
+    """,
+    """
+    CREATE TABLE catalog_courses (
+        course_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        fingerprint TEXT,
+        fetched_at REAL NOT NULL,
+        checked_at REAL NOT NULL
+    );
+    CREATE TABLE catalog_items (
+        course_id INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        lesson_number INTEGER NOT NULL DEFAULT 0,
+        extension TEXT,
+        item_type TEXT,
+        category TEXT,
+        PRIMARY KEY (course_id, url)
+    );
+    """,
+    """
+    CREATE INDEX idx_catalog_items_url ON catalog_items(url);
+    CREATE INDEX idx_catalog_items_course_type_lesson
+        ON catalog_items(course_id, item_type, lesson_number);
+    CREATE INDEX idx_catalog_items_type_lesson ON catalog_items(item_type, lesson_number);
+    """,
+]
+
+# Situação de um item do catálogo em consultas (cof catalog)
+CATALOG_STATUSES = ("missing", STATUS_DONE, STATUS_FAILED)
+
+
+class StateStore:
+    """Estado persistente dos downloads em SQLite (modo WAL).
+
+    Substitui os antigos stores ad-hoc (data/state.json, extracurriculares/
+    downloaded.json e os .archive.txt do yt-dlp), importados uma única vez na
+    primeira abertura. Cada atualização é uma transação pequena sobre uma
+    linha indexada, então o custo por download não cresce com o acervo.
+    """
+
+    def __init__(self, path: Path = STATE_DB) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=30.0)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self._import_legacy()
+
+    def __enter__(self) -> "StateStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _migrate(self) -> None:
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            # executescript faz COMMIT implícito; o user_version vai no mesmo script
+            self.conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {target};\nCOMMIT;")
+            logger.debug("Schema de estado migrado para versão %d", target)
+
+    def _import_legacy(self) -> None:
+        """Importa, uma única vez, os registros dos stores antigos."""
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+            return
+
+        entries: list[tuple[str, str]] = []
+        if STATE_FILE.exists():
+            data = json.loads(STATE_FILE.read_text())
+            entries += [(url, SCOPE_COF) for url in data.get("downloaded", [])]
+        extra_file = EXTRA_DIR / "downloaded.json"
+        if extra_file.exists():
+            entries += [(url, SCOPE_EXTRA) for url in json.loads(extra_file.read_text())]
+        for archive in DATA_DIR.glob("*/audios/.archive.txt"):
+            for line in archive.read_text().splitlines():
+                # Formato do yt-dlp: "<extractor> <id>"; nossas entradas usam a URL como id
+                parts = line.strip().split(" ", 1)
+                if len(parts) == 2 and parts[1].startswith("http"):
+                    entries.append((parts[1], SCOPE_AUDIOS))
+
+        now = time.time()
+        self.conn.execute("BEGIN")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO items (url, scope, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(url, scope, STATUS_DONE, now, now) for url, scope in entries],
+        )
+        self.conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', ?)", (str(now),))
+        self.conn.execute("COMMIT")
+        if entries:
+            logger.info("Importados %d registros dos arquivos de estado antigos", len(entries))
+
+    def get_meta(self, key: str) -> str | None:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def get(self, url: str) -> sqlite3.Row | None:
+        """Retorna o registro de um item, se existir."""
+        return self.conn.execute("SELECT * FROM items WHERE url = ?", (url,)).fetchone()
+
+    def is_done(self, url: str) -> bool:
+        """Indica se o item já foi baixado com sucesso."""
+        row = self.conn.execute("SELECT status FROM items WHERE url = ?", (url,)).fetchone()
+        return row is not None and row["status"] == STATUS_DONE
+
+    def done_urls(self, scope: str | None = None) -> set[str]:
+        """Retorna as URLs já baixadas (opcionalmente só de um escopo)."""
+        if scope is None:
+            rows = self.conn.execute("SELECT url FROM items WHERE status = ?", (STATUS_DONE,))
+        else:
+            rows = self.conn.execute(
+                "SELECT url FROM items WHERE scope = ? AND status = ?", (scope, STATUS_DONE)
+            )
+        return {row["url"] for row in rows}
+
+    def done_files(self) -> list[sqlite3.Row]:
+        """Registros concluídos com path no disco (url, path, size, sha256)."""
+        return self.conn.execute(
+            "SELECT url, path, size, sha256 FROM items WHERE status = ? AND path IS NOT NULL",
+            (STATUS_DONE,),
+        ).fetchall()
+
+    def record_checksum(self, url: str, sha256: str, size: int) -> None:
+        """Grava o checksum de um item que ainda não tinha um registrado."""
+        self.conn.execute(
+            "UPDATE items SET sha256 = ?, size = ? WHERE url = ?", (sha256, size, url)
+        )
+
+    def find_content(self, etag: str, size: int) -> str | None:
+        """Retorna o SHA-256 de um conteúdo já baixado com este ETag e tamanho."""
+        row = self.conn.execute(
+            "SELECT sha256 FROM items WHERE etag = ? AND size = ? AND sha256 IS NOT NULL "
+            "AND status = ? LIMIT 1",
+            (etag, size, STATUS_DONE),
+        ).fetchone()
+        return row["sha256"] if row else None
+
+    def mark_started(self, url: str, scope: str, path: Path | None = None) -> None:
+        """Registra o início de uma tentativa de download."""
+        now = time.time()
+        self.conn.execute(
+            "INSERT INTO items (url, scope, status, path, attempts, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET status = excluded.status, "
+            "path = COALESCE(excluded.path, path), attempts = attempts + 1, "
+            "error = NULL, updated_at = excluded.updated_at",
+            (url, scope, STATUS_DOWNLOADING, _str(path), now, now),
+        )
+
+    def mark_done(
+        self,
+        url: str,
+        scope: str,
+        path: Path | None = None,
+        size: int | None = None,
+        sha256: str | None = None,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> None:
+        """Registra um download concluído, com os validadores HTTP da resposta."""
+        now = time.time()
+        self.conn.execute(
+            "INSERT INTO items (url, scope, status, path, size, sha256, etag, last_modified, "
+            "created_at, updated_at, checked_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET status = excluded.status, "
+            "path = COALESCE(excluded.path, path), size = COALESCE(excluded.size, size), "
+            "sha256 = COALESCE(excluded.sha256, sha256), etag = excluded.etag, "
+            "last_modified = excluded.last_modified, error = NULL, "
+            "updated_at = excluded.updated_at, checked_at = excluded.checked_at",
+            (url, scope, STATUS_DONE, _str(path), size, sha256, etag, last_modified, now, now, now),
+        )
+
+    def mark_checked(
+        self,
+        url: str,
+        etag: str | None = None,
+        last_modified: str | None = None,
+        size: int | None = None,
+    ) -> None:
+        """Registra que o item foi conferido no servidor e não mudou."""
+        self.conn.execute(
+            "UPDATE items SET checked_at = ?, etag = COALESCE(?, etag), "
+            "last_modified = COALESCE(?, last_modified), size = COALESCE(?, size) WHERE url = ?",
+            (time.time(), etag, last_modified, size, url),
+        )
+
+    def check_due(self, url: str, max_age: float) -> bool:
+        """Item conferido (ou baixado) há mais de max_age segundos, ou nunca conferido."""
+        row = self.conn.execute("SELECT checked_at FROM items WHERE url = ?", (url,)).fetchone()
+        return row is None or row["checked_at"] is None or time.time() - row["checked_at"] >= max_age
+
+    def catalog_course(self, course_id: int) -> sqlite3.Row | None:
+        """Snapshot salvo de um curso (fingerprint, fetched_at, checked_at)."""
+        return self.conn.execute(
+            "SELECT * FROM catalog_courses WHERE course_id = ?", (course_id,)
+        ).fetchone()
+
+    def catalog_items(self, course_id: int) -> list[sqlite3.Row]:
+        """Itens do snapshot de um curso, na ordem em que foram descobertos."""
+        return self.conn.execute(
+            "SELECT * FROM catalog_items WHERE course_id = ? ORDER BY position", (course_id,)
+        ).fetchall()
+
+    def save_catalog(self, course_id: int, name: str, fingerprint: str | None, items: list[dict]) -> None:
+        """Substitui o snapshot de um curso.
+
+        items são dicts com as chaves media_url, title, lesson_number,
+        extension, item_type e category (campos de MediaItem).
+        """
+        now = time.time()
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute("DELETE FROM catalog_items WHERE course_id = ?", (course_id,))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO catalog_items (course_id, url, position, title, "
+                "lesson_number, extension, item_type, category) VALUES (:course_id, :media_url, "
+                ":position, :title, :lesson_number, :extension, :item_type, :category)",
+                [{**item, "course_id": course_id, "position": n} for n, item in enumerate(items)],
+            )
+            self.conn.execute(
+                "INSERT INTO catalog_courses (course_id, name, fingerprint, fetched_at, checked_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(course_id) DO UPDATE SET name = excluded.name, "
+                "fingerprint = excluded.fingerprint, fetched_at = excluded.fetched_at, "
+                "checked_at = excluded.checked_at",
+                (course_id, name, fingerprint, now, now),
+            )
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def mark_catalog_checked(self, course_id: int) -> None:
+        """Registra que o fingerprint do curso foi conferido e não mudou."""
+        self.conn.execute(
+            "UPDATE catalog_courses SET checked_at = ? WHERE course_id = ?", (time.time(), course_id)
+        )
+
+    def _catalog_filter(
+        self,
+        course: str | None,
+        item_type: str | None,
+        lessons: tuple[int, int] | None,
+        status: str | None,
+        search: str | None,
+    ) -> tuple[str, list]:
+        clauses, params = [], []
+        if course is not None:
+            if course.isdigit():
+                clauses.append("ci.course_id = ?")
+                params.append(int(course))
+            else:
+                clauses.append("c.name LIKE ?")
+                params.append(f"%{course}%")
+        if item_type is not None:
+            clauses.append("ci.item_type = ?")
+            params.append(item_type)
+        if lessons is not None:
+            clauses.append("ci.lesson_number BETWEEN ? AND ?")
+            params.extend(lessons)
+        if status == "missing":
+            clauses.append("(i.status IS NULL OR i.status != ?)")
+            params.append(STATUS_DONE)
+        elif status is not None:
+            clauses.append("i.status = ?")
+            params.append(status)
+        if search is not None:
+            clauses.append("ci.title LIKE ?")
+            params.append(f"%{search}%")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query_catalog(
+        self,
+        course: str | None = None,
+        item_type: str | None = None,
+        lessons: tuple[int, int] | None = None,
+        status: str | None = None,
+        search: str | None = None,
+        limit: int | None = None,
+    ) -> list[sqlite3.Row]:
+        """Itens do catálogo salvo, com a situação do download, filtrados.
+
+        Args:
+            course: Id do curso, ou parte do nome.
+            item_type: Tipo de conteúdo ("transcription", "audios", ...).
+            lessons: Intervalo fechado de números de aula.
+            status: "missing" (não baixado), "done" ou "failed".
+            search: Trecho do título.
+            limit: Número máximo de linhas.
+        """
+        where, params = self._catalog_filter(course, item_type, lessons, status, search)
+        sql = (
+            "SELECT ci.course_id, c.name AS course, ci.lesson_number, ci.item_type, ci.title, "
+            "ci.url, i.status, i.path, i.size "
+            "FROM catalog_items ci JOIN catalog_courses c ON c.course_id = ci.course_id "
+            f"LEFT JOIN items i ON i.url = ci.url{where} "
+            "ORDER BY ci.course_id, ci.lesson_number, ci.item_type, ci.position"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self.conn.execute(sql, params).fetchall()
+
+    def catalog_summary(
+        self,
+        course: str | None = None,
+        item_type: str | None = None,
+        lessons: tuple[int, int] | None = None,
+        status: str | None = None,
+        search: str | None = None,
+    ) -> list[sqlite3.Row]:
+        """Contagens por curso e tipo (total, baixados, falhos) com os mesmos filtros de query_catalog."""
+        where, params = self._catalog_filter(course, item_type, lessons, status, search)
+        return self.conn.execute(
+            "SELECT c.name AS course, ci.item_type, COUNT(*) AS total, "
+            "COALESCE(SUM(i.status = ?), 0) AS done, COALESCE(SUM(i.status = ?), 0) AS failed, "
+            "COALESCE(SUM(CASE WHEN i.status = ? THEN i.size END), 0) AS bytes "
+            "FROM catalog_items ci JOIN catalog_courses c ON c.course_id = ci.course_id "
+            f"LEFT JOIN items i ON i.url = ci.url{where} "
+            "GROUP BY ci.course_id, ci.item_type ORDER BY ci.course_id, ci.item_type",
+            [STATUS_DONE, STATUS_FAILED, STATUS_DONE, *params],
+        ).fetchall()
+
+    def mark_failed(self, url: str, scope: str, error: str) -> None:
+        """Registra uma tentativa de download que falhou."""
+        now = time.time()
+        self.conn.execute(
+            "INSERT INTO items (url, scope, status, attempts, error, created_at, updated_at) "
+            "VALUES (?, ?, ?, 1, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET status = excluded.status, "
+            "error = excluded.error, updated_at = excluded.updated_at",
+            (url, scope, STATUS_FAILED, error[:500], now, now),
+        )
+
+
+def _str(path: Path | None) -> str | None:
+    return str(path) if path is not None else None
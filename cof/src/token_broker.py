@@ -0,0 +1,119 @@
+import asyncio
+import base64
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
+
+from src.config import TOKEN_EXPIRY_MARGIN, TOKEN_FILE, TOKEN_LOCK_FILE
+
+logger = logging.getLogger("cof.token_broker")
+
+# Cache do processo: (mtime_ns do TOKEN_FILE, token)
+_cache: tuple[int, str] | None = None
+
+
+def token_expiry(token: str) -> float | None:
+    """Lê o claim exp (epoch) do payload do JWT, sem verificar a assinatura."""
+    try:
+        payload = token.split(".")[1]
+        data = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(data["exp"])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
+
+
+def token_fresh(token: str | None) -> bool:
+    """Token presente e, pelo exp, válido além da margem de segurança."""
+    expiry = token_expiry(token) if token else None
+    return expiry is not None and expiry - TOKEN_EXPIRY_MARGIN > time.time()
+
+
+def load_token() -> str | None:
+    """Token salvo em TOKEN_FILE, lido do disco só quando o arquivo muda.
+
+    O mtime é conferido a cada chamada, então um token renovado por outro
+    processo é visto na próxima leitura.
+    """
+    global _cache
+    try:
+        mtime = TOKEN_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        _cache = None
+        return None
+    if _cache is not None and _cache[0] == mtime:
+        return _cache[1]
+    try:
+        token = json.loads(TOKEN_FILE.read_text()).get("token")
+    except (OSError, ValueError) as e:
+        logger.warning("Token ilegível em %s: %s", TOKEN_FILE, e)
+        return None
+    _cache = (mtime, token) if token else None
+    logger.debug("Token carregado de %s", TOKEN_FILE)
+    return token
+
+
+def save_token(token: str) -> None:
+    """Persiste o token atomicamente (arquivo temporário + rename, modo 0600)."""
+    global _cache
+    TOKEN_FILE.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=TOKEN_FILE.parent, prefix=".token.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump({"token": token}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, TOKEN_FILE)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    _cache = (TOKEN_FILE.stat().st_mtime_ns, token)
+    logger.debug("Token salvo em %s", TOKEN_FILE)
+
+
+@asynccontextmanager
+async def _refresh_lock():
+    """Lock exclusivo (fcntl) entre processos, adquirido sem bloquear o event loop."""
+    TOKEN_LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(TOKEN_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        logger.info("Outro processo está renovando o token, aguardando")
+        waiter = asyncio.ensure_future(asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_EX))
+        try:
+            await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # A thread segue bloqueada no flock: o descritor só fecha quando ela retornar
+            waiter.add_done_callback(lambda _: os.close(fd))
+            raise
+    try:
+        yield
+    finally:
+        os.close(fd)  # fechar o descritor libera o lock
+
+
+async def refresh_token(login: Callable[[], Awaitable[str]], stale: str | None) -> str:
+    """Obtém um token novo, com no máximo um login por vez entre todos os processos.
+
+    Quem pega o lock confere o disco antes de logar: se outro processo já
+    trocou o token stale por um válido, ele é reaproveitado sem novo login.
+
+    Args:
+        login: Corotina que faz o login e retorna o token (ver src.auth.login).
+        stale: Token que motivou a renovação (revogado, expirado ou ausente).
+    """
+    async with _refresh_lock():
+        token = load_token()
+        # Sem exp legível não há como saber a idade: diferente do stale, vale
+        if token and token != stale and (token_fresh(token) or token_expiry(token) is None):
+            logger.info("Token já renovado por outro processo")
+            return token
+        token = await login()
+        save_token(token)
+        return token
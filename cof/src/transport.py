@@ -0,0 +1,441 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Protocol
+from urllib.parse import urlparse
+
+import httpx
+
+from src.config import (
+    API_BASE,
+    CASSETTE_DIR,
+    CHUNK_SIZE,
+    SYNTHETIC_COURSES,
+    SYNTHETIC_FILE_SIZE,
+    SYNTHETIC_FILES_HOST,
+    SYNTHETIC_SOURCES,
+    TRANSPORT_BANDWIDTH,
+    TRANSPORT_LATENCY,
+    TYPE_PRIORITY,
+)
+
+logger = logging.getLogger("cof.transport")
+
+# Modos do --transport
+TRANSPORT_MODES = ("live", "record", "replay", "synthetic")
+
+# Headers que não vão para o cassette
+_SKIPPED_HEADERS = {"set-cookie", "transfer-encoding", "content-length"}
+
+_RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)$")
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+
+# --- Corpos de resposta servidos por replay/synthetic ---
+
+
+class _Body(Protocol):
+    """Conteúdo de tamanho conhecido lido por offset (permite servir Range)."""
+
+    size: int
+
+    def read(self, offset: int, n: int) -> bytes: ...
+
+
+class _BytesBody:
+    def __init__(self, data: bytes) -> None:
+        self._data = data
+        self.size = len(data)
+
+    def read(self, offset: int, n: int) -> bytes:
+        return self._data[offset:offset + n]
+
+
+class _FileBody:
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self.size = path.stat().st_size
+
+    def read(self, offset: int, n: int) -> bytes:
+        with open(self._path, "rb") as f:
+            f.seek(offset)
+            return f.read(n)
+
+
+class _SyntheticBody:
+    """Bytes pseudoaleatórios determinísticos: o mesmo seed gera sempre o mesmo conteúdo."""
+
+    _BLOCK = 64 * 1024
+
+    def __init__(self, size: int, seed: int) -> None:
+        self.size = size
+        self._block = random.Random(seed).randbytes(self._BLOCK)
+
+    def read(self, offset: int, n: int) -> bytes:
+        n = max(0, min(n, self.size - offset))
+        out = bytearray()
+        while len(out) < n:
+            start = (offset + len(out)) % self._BLOCK
+            out += self._block[start:start + n - len(out)]
+        return bytes(out)
+
+
+class _PacedStream(httpx.AsyncByteStream):
+    """Entrega body[start:end] em blocos, limitado a bandwidth bytes/s (None = sem limite)."""
+
+    def __init__(self, body: _Body, start: int, end: int, bandwidth: int | None) -> None:
+        self._body = body
+        self._start = start
+        self._end = end
+        self._bandwidth = bandwidth
+
+    async def __aiter__(self):
+        offset = self._start
+        while offset < self._end:
+            chunk = self._body.read(offset, min(CHUNK_SIZE, self._end - offset))
+            if not chunk:
+                return
+            if self._bandwidth:
+                await asyncio.sleep(len(chunk) / self._bandwidth)
+            offset += len(chunk)
+            yield chunk
+
+
+def _serve(
+    request: httpx.Request,
+    status: int,
+    headers: dict[str, str],
+    body: _Body,
+    bandwidth: int | None,
+) -> httpx.Response:
+    """Monta a resposta, aplicando Range, If-Range e If-None-Match sobre um corpo 200."""
+    headers = dict(headers)
+    start, end = 0, body.size
+    if status == 200:
+        etag = headers.get("etag")
+        if etag and request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers=headers, request=request)
+        headers["accept-ranges"] = "bytes"
+        match = _RANGE_RE.match(request.headers.get("range", ""))
+        if_range = request.headers.get("if-range")
+        if match and (not if_range or if_range in (etag, headers.get("last-modified"))):
+            start = int(match.group(1))
+            if start >= body.size:
+                headers["content-range"] = f"bytes */{body.size}"
+                return httpx.Response(416, headers=headers, request=request)
+            if match.group(2):
+                end = min(body.size, int(match.group(2)) + 1)
+            status = 206
+            headers["content-range"] = f"bytes {start}-{end - 1}/{body.size}"
+    headers["content-length"] = str(end - start)
+    return httpx.Response(
+        status, headers=headers, stream=_PacedStream(body, start, end, bandwidth), request=request
+    )
+
+
+# --- Gravação ---
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """Repassa o corpo da resposta e o copia para o cassette enquanto é lido."""
+
+    def __init__(
+        self,
+        stream: httpx.AsyncByteStream,
+        cassette: "RecordingTransport",
+        entry: dict,
+        segment: tuple[int, int] | None,
+    ) -> None:
+        self._stream = stream
+        self._cassette = cassette
+        self._entry = entry
+        self._segment = segment
+        self._complete = False
+
+    async def __aiter__(self):
+        fd, tmp = tempfile.mkstemp(dir=self._cassette.bodies_dir, suffix=".tmp")
+        h = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in self._stream:
+                    f.write(chunk)
+                    h.update(chunk)
+                    yield chunk
+            self._complete = True
+        finally:
+            if self._complete:
+                self._cassette.save_body(self._entry, Path(tmp), h.hexdigest(), self._segment)
+            else:
+                os.unlink(tmp)
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+class _PartialBody:
+    """Segmentos (respostas 206) de uma URL, montados num arquivo até cobrirem o corpo inteiro."""
+
+    def __init__(self, path: Path, total: int, etag: str | None) -> None:
+        self.path = path
+        self.total = total
+        self.etag = etag
+        self._ranges: list[tuple[int, int]] = []
+        with open(path, "wb") as f:
+            f.truncate(total)
+
+    def add(self, start: int, data: Path) -> bool:
+        """Copia o segmento para o offset start; True quando o corpo está completo."""
+        with open(data, "rb") as src, open(self.path, "r+b") as dst:
+            dst.seek(start)
+            shutil.copyfileobj(src, dst)
+            self._ranges.append((start, dst.tell()))
+        covered = 0
+        for begin, end in sorted(self._ranges):
+            if begin > covered:
+                return False
+            covered = max(covered, end)
+        return covered >= self.total
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Executa as requisições de verdade e grava as respostas num cassette.
+
+    O cassette é um diretório com index.jsonl (método, URL, status, headers)
+    e os corpos em bodies/<sha256>. Só respostas lidas até o fim são
+    gravadas. Respostas 206 são sempre gravadas como o corpo 200 completo,
+    do qual o replay serve qualquer range: um "Range: bytes=0-" já é o
+    corpo inteiro, e os segmentos de um download segmentado (ou retomado)
+    são montados por URL e gravados quando cobrem o arquivo todo.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, cassette: Path) -> None:
+        self._transport = transport
+        self.cassette = cassette
+        self.bodies_dir = cassette / "bodies"
+        self.bodies_dir.mkdir(parents=True, exist_ok=True)
+        self._index = open(cassette / "index.jsonl", "a")
+        self._partials: dict[str, _PartialBody] = {}
+
+    def append(self, entry: dict) -> None:
+        self._index.write(json.dumps(entry) + "\n")
+        self._index.flush()
+
+    def save_body(self, entry: dict, data: Path, sha: str, segment: tuple[int, int] | None) -> None:
+        """Grava o corpo lido de uma resposta; segment = (início, total) de um 206 parcial."""
+        if segment is None:
+            os.replace(data, self.bodies_dir / sha)
+            self.append({**entry, "body": sha})
+            return
+
+        start, total = segment
+        url, etag = entry["url"], entry["headers"].get("etag")
+        partial = self._partials.get(url)
+        if partial is None or partial.total != total or partial.etag != etag:
+            # Primeiro segmento, ou o arquivo mudou no servidor: recomeça a montagem
+            name = hashlib.sha256(url.encode()).hexdigest() + ".partial"
+            partial = self._partials[url] = _PartialBody(self.bodies_dir / name, total, etag)
+        try:
+            complete = partial.add(start, data)
+        finally:
+            os.unlink(data)
+        if complete:
+            del self._partials[url]
+            sha = _file_sha256(partial.path)
+            os.replace(partial.path, self.bodies_dir / sha)
+            self.append({**entry, "body": sha})
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self._transport.handle_async_request(request)
+        status = response.status_code
+        headers = {k.lower(): v for k, v in response.headers.items() if k.lower() not in _SKIPPED_HEADERS}
+        segment = None
+        if status == 206:
+            match = _CONTENT_RANGE_RE.fullmatch(headers.pop("content-range", ""))
+            if match is None:
+                # Sem o tamanho total não há como montar o corpo: não é gravada
+                logger.warning("Resposta 206 sem Content-Range completo não gravada: %s", request.url)
+                return response
+            start, last, total = map(int, match.groups())
+            status = 200
+            if not (start == 0 and last + 1 == total):
+                segment = (start, total)
+        entry = {"method": request.method, "url": str(request.url), "status": status, "headers": headers}
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, self, entry, segment),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    async def aclose(self) -> None:
+        for url, partial in self._partials.items():
+            logger.warning("Download incompleto não gravado no cassette: %s", url)
+            partial.path.unlink(missing_ok=True)
+        self._partials.clear()
+        if not self._index.closed:
+            self._index.close()
+        await self._transport.aclose()
+
+
+# --- Replay ---
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Responde a partir de um cassette gravado, sem acessar a rede.
+
+    As respostas são casadas por método e URL (a última gravação vence) e
+    servidas com latência e banda configuráveis. Requisições que não estão
+    no cassette recebem 404. Respostas 206 (parciais) de cassettes antigos
+    são ignoradas: um mesmo segmento serviria todos os ranges da URL.
+    """
+
+    def __init__(
+        self,
+        cassette: Path,
+        latency: float = TRANSPORT_LATENCY,
+        bandwidth: int | None = TRANSPORT_BANDWIDTH,
+    ) -> None:
+        self._bodies = cassette / "bodies"
+        self._latency = latency
+        self._bandwidth = bandwidth
+        self._entries: dict[tuple[str, str], dict] = {}
+        with open(cassette / "index.jsonl") as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["status"] == 206:
+                    logger.warning("Gravação parcial ignorada: %s", entry["url"])
+                    continue
+                self._entries[(entry["method"], entry["url"])] = entry
+        logger.info("Cassette %s: %d respostas", cassette, len(self._entries))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self._latency)
+        entry = self._entries.get((request.method, str(request.url)))
+        if entry is None:
+            logger.warning("Sem gravação para %s %s", request.method, request.url)
+            return httpx.Response(404, json={"detail": "não gravado"}, request=request)
+        body = _FileBody(self._bodies / entry["body"])
+        return _serve(request, entry["status"], entry["headers"], body, self._bandwidth)
+
+
+# --- Catálogo sintético ---
+
+
+_EXTENSIONS = {"transcription": "pdf", "books": "pdf", "audios": "mp3", "videos": "mp4"}
+
+
+class SyntheticTransport(httpx.AsyncBaseTransport):
+    """Simula a API e a CDN com um catálogo gerado de qualquer tamanho.
+
+    São n_courses cursos com n_sources sources cada (tipos alternados entre
+    TYPE_PRIORITY), todos com arquivo de file_size bytes pseudoaleatórios e
+    determinísticos, servidos com suporte a Range, ETag e If-None-Match.
+    Respostas têm latência e banda configuráveis, para benchmarks do
+    pipeline inteiro sem rede.
+    """
+
+    def __init__(
+        self,
+        n_courses: int = SYNTHETIC_COURSES,
+        n_sources: int = SYNTHETIC_SOURCES,
+        file_size: int = SYNTHETIC_FILE_SIZE,
+        latency: float = TRANSPORT_LATENCY,
+        bandwidth: int | None = TRANSPORT_BANDWIDTH,
+    ) -> None:
+        self.courses = [(n, f"Curso Sintético {n}") for n in range(1, n_courses + 1)]
+        self._n_sources = n_sources
+        self._n_lessons = max(1, n_sources // len(TYPE_PRIORITY))
+        self._file_size = file_size
+        self._latency = latency
+        self._bandwidth = bandwidth
+        self._api = urlparse(API_BASE)
+
+    def _lessons(self, course_id: int) -> list[dict]:
+        return [{"id": course_id * 100_000 + n, "number": n} for n in range(1, self._n_lessons + 1)]
+
+    def _sources(self, course_id: int) -> list[dict]:
+        sources = []
+        for n in range(self._n_sources):
+            item_type = TYPE_PRIORITY[n % len(TYPE_PRIORITY)]
+            lesson = n // len(TYPE_PRIORITY) % self._n_lessons + 1
+            sources.append({
+                "id": course_id * 100_000 + n,
+                "name": f"Source {n}",
+                "lesson": course_id * 100_000 + lesson,
+                "category_key": item_type,
+                "category": item_type,
+                "file": f"https://{SYNTHETIC_FILES_HOST}/{course_id}/{n}.{_EXTENSIONS[item_type]}",
+            })
+        return sources
+
+    def _page(self, request: httpx.Request, results: list[dict]) -> httpx.Response:
+        params = request.url.params
+        if params.get("sort") == "desc":
+            results = results[::-1]
+        limit = int(params.get("limit", 100))
+        offset = int(params.get("offset", 0))
+        more = offset + limit < len(results)
+        next_url = str(request.url.copy_merge_params({"offset": offset + limit})) if more else None
+        data = {"count": len(results), "next": next_url, "results": results[offset:offset + limit]}
+        return self._json(request, data)
+
+    def _json(self, request: httpx.Request, data: dict) -> httpx.Response:
+        body = _BytesBody(json.dumps(data).encode())
+        return _serve(request, 200, {"content-type": "application/json"}, body, None)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self._latency)
+        host, path = request.url.host, request.url.path
+
+        if host == SYNTHETIC_FILES_HOST:
+            course_id, name = path.strip("/").split("/")
+            seed = int(course_id) * 100_000 + int(name.split(".")[0])
+            headers = {"etag": f'"synthetic-{seed}-{self._file_size}"'}
+            return _serve(request, 200, headers, _SyntheticBody(self._file_size, seed), self._bandwidth)
+
+        if host == self._api.hostname and path.startswith(self._api.path):
+            endpoint = path[len(self._api.path):]
+            if endpoint in ("/accounts/", "/courses/"):
+                return self._json(request, {"results": []})
+            if endpoint == "/user/courses/":
+                return self._page(request, [
+                    {"id": cid, "title": name, "count_lessons": self._n_lessons}
+                    for cid, name in self.courses
+                ])
+            match = re.fullmatch(r"/courses/(lessons|sources)/(\d+)", endpoint)
+            if match:
+                listing = self._lessons if match.group(1) == "lessons" else self._sources
+                return self._page(request, listing(int(match.group(2))))
+
+        return httpx.Response(404, json={"detail": "não encontrado"}, request=request)
+
+
+def create_transport(mode: str, cassette: Path | None = None) -> httpx.AsyncBaseTransport | None:
+    """Transport base para o modo de --transport; None = rede de verdade (live)."""
+    cassette = cassette or CASSETTE_DIR
+    if mode == "live":
+        return None
+    if mode == "record":
+        logger.info("Gravando respostas em %s", cassette)
+        return RecordingTransport(httpx.AsyncHTTPTransport(), cassette)
+    if mode == "replay":
+        return ReplayTransport(cassette)
+    if mode == "synthetic":
+        return SyntheticTransport()
+    raise ValueError(f"Modo de transport inválido: {mode!r}")
@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from src.config import VERIFY_WORKERS
+from src.state import StateStore
+
+logger = logging.getLogger("cof.verify")
+
+MMAP_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def hash_file_mmap(path: str) -> tuple[int, str]:
+    """Calcula tamanho e SHA-256 de um arquivo lendo-o via mmap.
+
+    Executada nos processos do pool: o mmap evita cópias para buffers do
+    Python e o hashlib libera o GIL em blocos grandes.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0, h.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if hasattr(m, "madvise"):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(m)
+            try:
+                for start in range(0, size, MMAP_BLOCK_SIZE):
+                    h.update(view[start:start + MMAP_BLOCK_SIZE])
+            finally:
+                view.release()
+    return size, h.hexdigest()
+
+
+@dataclass
+class VerifyReport:
+    """Resultado da verificação do acervo."""
+
+    ok: int = 0
+    baseline: int = 0  # sem checksum registrado; hash calculado e gravado agora
+    missing: list[str] = field(default_factory=list)
+    truncated: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)
+
+    @property
+    def problems(self) -> int:
+        return len(self.missing) + len(self.truncated) + len(self.modified)
+
+
+def verify_library(store: StateStore, workers: int = VERIFY_WORKERS) -> VerifyReport:
+    """Confere todos os arquivos baixados contra o tamanho e o SHA-256 registrados.
+
+    Arquivos ausentes e menores que o registrado são detectados só com stat;
+    os demais são re-hasheados em paralelo num pool de processos. Paths que
+    são hardlinks para o mesmo blob são hasheados uma única vez.
+    """
+    report = VerifyReport()
+    rows = store.done_files()
+
+    # inode -> registros que apontam para ele
+    to_hash: dict[tuple[int, int], list] = {}
+    for row in rows:
+        path = Path(row["path"])
+        if not path.exists():
+            report.missing.append(row["path"])
+            continue
+        st = path.stat()
+        if not path.is_file():
+            # Playlists do yt-dlp são registradas pelo diretório
+            continue
+        if row["size"] is not None and st.st_size < row["size"]:
+            report.truncated.append(row["path"])
+            continue
+        if row["size"] is not None and st.st_size != row["size"]:
+            report.modified.append(row["path"])
+            continue
+        to_hash.setdefault((st.st_dev, st.st_ino), []).append(row)
+
+    logger.info(
+        "Verificando %d arquivos (%d conteúdos distintos) com %d processos",
+        len(rows), len(to_hash), workers,
+    )
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(hash_file_mmap, group[0]["path"]): group for group in to_hash.values()}
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                size, sha256 = future.result()
+            except OSError as e:
+                logger.error("Erro ao ler %s: %s", group[0]["path"], e)
+                report.missing.extend(row["path"] for row in group)
+                continue
+            for row in group:
+                if row["sha256"] is None:
+                    store.record_checksum(row["url"], sha256, size)
+                    report.baseline += 1
+                elif row["sha256"] == sha256:
+                    report.ok += 1
+                else:
+                    report.modified.append(row["path"])
+
+    for label, paths in (
+        ("AUSENTE", report.missing),
+        ("TRUNCADO", report.truncated),
+        ("MODIFICADO", report.modified),
+    ):
+        for path in paths:
+            logger.warning("%s: %s", label, path)
+    logger.info(
+        "Verificação concluída: %d OK, %d com checksum registrado agora, "
+        "%d ausentes, %d truncados, %d modificados",
+        report.ok, report.baseline, len(report.missing), len(report.truncated), len(report.modified),
+    )
+    return report
@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from src.config import FSYNC_POLICY, WRITE_BUFFER_SIZE, WRITE_QUEUE_DEPTH, WRITER_THREADS
+
+logger = logging.getLogger("cof.writer")
+
+FSYNC_POLICIES = ("never", "close", "always")
+
+_executor = ThreadPoolExecutor(max_workers=WRITER_THREADS, thread_name_prefix="cof-writer")
+
+
+def _preallocate(fd: int, size: int) -> None:
+    """Reserva size bytes no disco para o arquivo (posix_fallocate, se disponível)."""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError) as e:
+        # Sistemas de arquivos sem fallocate: ao menos fixa o tamanho final
+        logger.debug("posix_fallocate indisponível (%s), usando ftruncate", e)
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+
+
+class FileWriter:
+    """Estágio de escrita em disco desacoplado do event loop.
+
+    A rede entrega blocos (offset, bytes) por uma fila limitada; uma task
+    consumidora agrupa blocos contíguos em escritas de até WRITE_BUFFER_SIZE
+    e as executa no pool de threads. A memória usada fica limitada pela
+    profundidade da fila, e o event loop nunca bloqueia em I/O de disco.
+
+    Enquanto as escritas forem sequenciais a partir do offset 0, o writer
+    também calcula o SHA-256 do conteúdo na thread de escrita.
+    """
+
+    def __init__(self, fd: int, fsync: str = FSYNC_POLICY, hash_from_start: bool = False) -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"FSYNC_POLICY inválida: {fsync!r}")
+        self._fd = fd
+        self._fsync = fsync
+        self._hasher = hashlib.sha256() if hash_from_start else None
+        self.hashed_bytes = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=WRITE_QUEUE_DEPTH)
+        self._error: BaseException | None = None
+        self._task = asyncio.create_task(self._consume())
+
+    @property
+    def sha256(self) -> str | None:
+        """SHA-256 dos bytes 0..hashed_bytes, ou None se a escrita não foi sequencial."""
+        return self._hasher.hexdigest() if self._hasher else None
+
+    def _hash(self, offset: int, data: bytes) -> None:
+        if self._hasher is None:
+            return
+        if offset != self.hashed_bytes:
+            self._hasher = None
+            return
+        self._hasher.update(data)
+        self.hashed_bytes += len(data)
+
+    def _write_runs(self, runs: list[tuple[int, list[bytes]]]) -> None:
+        """Grava (na thread de escrita) cada sequência contígua com um único pwrite."""
+        for offset, chunks in runs:
+            data = b"".join(chunks) if len(chunks) > 1 else chunks[0]
+            self._hash(offset, data)
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(self._fd, view, offset)
+                offset += written
+                view = view[written:]
+        if self._fsync == "always":
+            os.fsync(self._fd)
+
+    async def write(self, offset: int, data: bytes) -> None:
+        """Enfileira um bloco para ser gravado na posição offset."""
+        if self._error:
+            raise self._error
+        await self._queue.put((offset, data))
+
+    async def drain(self) -> None:
+        """Aguarda até que todos os blocos enfileirados estejam gravados."""
+        await self._queue.join()
+        if self._error:
+            raise self._error
+
+    async def close(self) -> None:
+        """Grava o que resta na fila, aplica a política de fsync e encerra."""
+        await self._queue.put(None)
+        await self._task
+        if self._error:
+            raise self._error
+        if self._fsync == "close":
+            await asyncio.get_running_loop().run_in_executor(_executor, os.fsync, self._fd)
+
+    async def _consume(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][1]) if batch[0] else 0
+            while batch[-1] is not None and size < WRITE_BUFFER_SIZE and not self._queue.empty():
+                item = self._queue.get_nowait()
+                batch.append(item)
+                size += len(item[1]) if item else 0
+
+            stop = batch[-1] is None
+            blocks = [b for b in batch if b is not None]
+            try:
+                if blocks and not self._error:
+                    runs = _coalesce(blocks)
+                    await loop.run_in_executor(_executor, self._write_runs, runs)
+            except Exception as e:
+                # Continua consumindo (e descartando) para não travar produtores
+                logger.error("Erro de escrita em disco: %s", e)
+                self._error = e
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+
+def _coalesce(blocks: list[tuple[int, bytes]]) -> list[tuple[int, list[bytes]]]:
+    """Agrupa blocos em sequências contíguas (ordenadas por offset)."""
+    runs: list[tuple[int, list[bytes]]] = []
+    end = None
+    for offset, data in sorted(blocks, key=lambda b: b[0]):
+        if runs and offset == end:
+            runs[-1][1].append(data)
+        else:
+            runs.append((offset, [data]))
+        end = offset + len(data)
+    return runs
+
+
+@asynccontextmanager
+async def open_writer(path: Path, preallocate: int | None = None, truncate: bool = False):
+    """Abre path para escrita posicional através de um FileWriter.
+
+    Args:
+        path: Arquivo de destino (criado se não existir).
+        preallocate: Tamanho final conhecido, reservado com posix_fallocate.
+        truncate: Se True, descarta o conteúdo existente e calcula o SHA-256
+            do que for escrito sequencialmente.
+    """
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if truncate else 0)
+    fd = os.open(path, flags, 0o644)
+    try:
+        loop = asyncio.get_running_loop()
+        if preallocate:
+            await loop.run_in_executor(_executor, _preallocate, fd, preallocate)
+        writer = FileWriter(fd, hash_from_start=truncate)
+        try:
+            yield writer
+        finally:
+            await writer.close()
+    finally:
+        os.close(fd)
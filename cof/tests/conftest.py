@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# src.config exige as credenciais e grava em DATA_DIR: isola os testes do acervo real
+os.environ.setdefault("COF_EMAIL", "teste@example.com")
+os.environ.setdefault("COF_PASSWORD", "teste")
+os.environ["COF_DATA_DIR"] = tempfile.mkdtemp(prefix="cof-tests-")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,46 @@
+import asyncio
+import base64
+import json
+import time
+
+from src import auth
+from src.auth import TokenManager
+
+
+def _jwt(exp: float) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode()).decode().rstrip("=")
+    return f"header.{payload}.signature"
+
+
+def test_expired_token_is_renewed_before_get_returns(monkeypatch):
+    expired = _jwt(time.time() + 60)  # dentro de TOKEN_EXPIRY_MARGIN
+    renewed = _jwt(time.time() + 24 * 3600)
+    logins: list[str | None] = []
+
+    async def fake_refresh_token(login, stale):
+        logins.append(stale)
+        return renewed
+
+    monkeypatch.setattr(auth, "refresh_token", fake_refresh_token)
+
+    async def run():
+        async with TokenManager(client=None) as tokens:
+            tokens.token = expired
+            tokens._verified = expired
+            assert not tokens.verified
+            token = await tokens.get()
+            return token, tokens.verified
+
+    assert asyncio.run(run()) == (renewed, True)
+    assert logins == [expired]
+
+
+def test_token_loaded_from_disk_is_not_verified(monkeypatch):
+    fresh = _jwt(time.time() + 24 * 3600)
+    monkeypatch.setattr(auth, "load_token", lambda: fresh)
+
+    async def run():
+        async with TokenManager(client=None) as tokens:
+            return await tokens.get(), tokens.verified
+
+    assert asyncio.run(run()) == (fresh, False)
@@ -0,0 +1,168 @@
+import asyncio
+import itertools
+import time
+
+import httpx
+
+from src import downloader
+from src.bandwidth import TokenBucket
+from src.downloader import DownloadResult, HostLimiter, _download_stream
+from src.planner import THROUGHPUT_KEY
+from src.scraper import MediaItem
+from src.state import SCOPE_COF, StateStore
+
+
+async def _endless_items():
+    """Descoberta que nunca termina antes do prazo (fila sempre cheia)."""
+    for n in itertools.count(1):
+        yield MediaItem(
+            title=f"Item {n}",
+            lesson_number=n,
+            media_url=f"https://files.test.invalid/{n}.pdf",
+            extension="pdf",
+            item_type="books",
+            course_name="Curso de Teste",
+        )
+        await asyncio.sleep(0)
+
+
+async def _items(count: int):
+    """Descoberta finita: os count primeiros itens de _endless_items."""
+    async for item in _endless_items():
+        if item.lesson_number > count:
+            return
+        yield item
+
+
+def test_deadline_stops_dequeuing(tmp_path, monkeypatch):
+    started: list[float] = []
+
+    async def fake_download(client, url, dest, limiter, store):
+        started.append(time.time())
+        await asyncio.sleep(0.3)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        dest.write_bytes(b"x")
+        return DownloadResult(path=dest, size=1, sha256="0" * 64)
+
+    monkeypatch.setattr(downloader, "download_file", fake_download)
+    monkeypatch.setattr(downloader, "DOWNLOAD_QUEUE_DEPTH", 16)
+
+    with StateStore(tmp_path / "cof.db") as store:
+        # Vazão alta: o orçamento do batch não limita, só o prazo
+        store.set_meta(THROUGHPUT_KEY, str(10**12))
+        deadline = time.time() + 1.0
+        asyncio.run(
+            _download_stream(store, _endless_items(), None, dry_run=False, refresh=False, deadline=deadline)
+        )
+        finished = time.time()
+
+    assert started
+    assert all(t < deadline for t in started)
+    assert finished - deadline < 0.5
+
+
+def test_reused_content_not_counted_in_throughput(tmp_path, monkeypatch):
+    async def reused_download(client, url, dest, limiter, store):
+        return DownloadResult(path=dest, size=10**9, sha256="0" * 64, reused=True)
+
+    monkeypatch.setattr(downloader, "download_file", reused_download)
+
+    with StateStore(tmp_path / "cof.db") as store:
+        asyncio.run(_download_stream(store, _items(3), None, dry_run=False, refresh=False))
+        assert store.get_meta(THROUGHPUT_KEY) is None
+
+
+def test_refresh_skips_recently_checked(tmp_path, monkeypatch):
+    checked: list[str] = []
+
+    async def fake_refresh(client, url, dest, row, limiter, store):
+        checked.append(url)
+        return None
+
+    monkeypatch.setattr(downloader, "refresh_file", fake_refresh)
+
+    with StateStore(tmp_path / "cof.db") as store:
+        recent, stale = "https://files.test.invalid/1.pdf", "https://files.test.invalid/2.pdf"
+        for url in (recent, stale):
+            store.mark_done(url, SCOPE_COF, tmp_path / "x.pdf")
+        store.conn.execute("UPDATE items SET checked_at = NULL WHERE url = ?", (stale,))
+        asyncio.run(_download_stream(store, _items(2), None, dry_run=False, refresh=True))
+
+    assert checked == [stale]
+
+
+def test_throughput_excludes_pacing(tmp_path):
+    body = b"x" * 100_000
+
+    async def run(store):
+        # Pacing de 0.3s entre arquivos: o batch leva ~0.6s, a transferência quase nada
+        limiter = HostLimiter(min_interval={}, default_min_interval=0.3, bandwidth=TokenBucket(rate=10**12))
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+        async with httpx.AsyncClient(transport=transport) as client:
+            await _download_stream(store, _items(3), client, dry_run=False, refresh=False, limiter=limiter)
+
+    with StateStore(tmp_path / "cof.db") as store:
+        asyncio.run(run(store))
+        rate = float(store.get_meta(THROUGHPUT_KEY))
+
+    assert rate > 3 * len(body) / 0.3
+
+
+def test_priority_applies_to_items_discovered_later(tmp_path, monkeypatch):
+    order: list[str] = []
+
+    async def fake_download(client, url, dest, limiter, store):
+        order.append(url)
+        return DownloadResult(path=dest, size=1, sha256="0" * 64, reused=True)
+
+    async def items():
+        # O vídeo chega primeiro, as transcrições (mais prioritárias) depois
+        for n, item_type in enumerate(["videos", "transcription", "transcription"], 1):
+            yield MediaItem(
+                title=f"Item {n}",
+                lesson_number=n,
+                media_url=f"https://files.test.invalid/{n}",
+                extension="pdf",
+                item_type=item_type,
+                course_name="Curso de Teste",
+            )
+            await asyncio.sleep(0)
+
+    monkeypatch.setattr(downloader, "download_file", fake_download)
+    monkeypatch.setattr(downloader, "DOWNLOAD_WORKERS", 1)
+
+    with StateStore(tmp_path / "cof.db") as store:
+        store.set_meta(THROUGHPUT_KEY, str(10**12))
+        asyncio.run(_download_stream(store, items(), None, dry_run=False, refresh=False))
+
+    assert order[-1] == "https://files.test.invalid/1"
+
+
+def test_deadline_closes_discovery(tmp_path, monkeypatch):
+    closed = []
+
+    async def items():
+        try:
+            async for item in _endless_items():
+                yield item
+        finally:
+            # Como o iter_media, a limpeza precisa do event loop (tarefas da descoberta)
+            await asyncio.sleep(0)
+            closed.append(True)
+
+    async def slow_download(client, url, dest, limiter, store):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(downloader, "download_file", slow_download)
+    monkeypatch.setattr(downloader, "DOWNLOAD_QUEUE_DEPTH", 4)
+
+    async def run(store):
+        # Orçamento folgado: a descoberta fica parada na fila cheia quando o prazo chega
+        store.set_meta(THROUGHPUT_KEY, str(10**12))
+        deadline = time.time() + 0.2
+        await _download_stream(store, items(), None, dry_run=False, refresh=False, deadline=deadline)
+        # Ainda dentro do event loop: não depende do shutdown_asyncgens do asyncio.run
+        return list(closed)
+
+    with StateStore(tmp_path / "cof.db") as store:
+        assert asyncio.run(run(store)) == [True]
@@ -0,0 +1,61 @@
+import asyncio
+
+import httpx
+
+from src.resilience import CircuitBreaker, HostLimitedTransport, HostLimiter, ResilientTransport
+
+API = "https://api.test.invalid/v1/courses/"
+
+
+def test_api_requests_respect_host_concurrency():
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200, json={"results": []})
+
+    limiter = HostLimiter(concurrency={"api.test.invalid": 2}, min_interval={}, default_min_interval=0.0)
+
+    async def run():
+        transport = HostLimitedTransport(httpx.MockTransport(handler), limiter)
+        async with httpx.AsyncClient(transport=transport) as client:
+            responses = await asyncio.gather(*(client.get(API) for _ in range(8)))
+        return [r.status_code for r in responses]
+
+    assert asyncio.run(run()) == [200] * 8
+    assert peak == 2
+
+
+
+def test_half_open_circuit_sends_a_single_probe():
+    healthy = False
+    calls: list[tuple[float, float]] = []  # (início, fim) de cada requisição
+
+    async def handler(request):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.sleep(0.02)
+        calls.append((started, loop.time()))
+        return httpx.Response(200 if healthy else 503)
+
+    async def run():
+        nonlocal healthy
+        breaker = CircuitBreaker(threshold=1, cooldown=0.05, max_wait=5.0)
+        transport = ResilientTransport(httpx.MockTransport(handler), breaker)
+        async with httpx.AsyncClient(transport=transport) as client:
+            # POST não é repetido: a primeira falha abre o circuito
+            assert (await client.post(API)).status_code == 503
+            healthy = True
+            calls.clear()
+            responses = await asyncio.gather(*(client.get(API) for _ in range(8)))
+        return [r.status_code for r in responses]
+
+    assert asyncio.run(run()) == [200] * 8
+    # Passado o cooldown, a requisição de teste vai sozinha; as demais, depois dela
+    probe, *others = sorted(calls)
+    assert all(started >= probe[1] for started, _ in others)
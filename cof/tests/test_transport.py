@@ -0,0 +1,33 @@
+import asyncio
+import json
+
+import httpx
+
+from src import downloader
+from src.bandwidth import TokenBucket
+from src.transport import RecordingTransport, ReplayTransport, SyntheticTransport
+
+URL = "https://files.synthetic.invalid/1/3.mp4"
+SIZE = 4 * 1024 * 1024 + 12345
+
+
+def test_segmented_download_replays(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "SEGMENT_THRESHOLD", 1024 * 1024)
+    cassette = tmp_path / "cassette"
+
+    async def download(transport, name):
+        # Sem pacing nem limite de banda: só o transport importa aqui
+        limiter = downloader.HostLimiter(
+            min_interval={}, default_min_interval=0.0, bandwidth=TokenBucket(rate=10**12)
+        )
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await downloader.download_file(client, URL, tmp_path / name, limiter)
+
+    synthetic = SyntheticTransport(1, 8, SIZE, latency=0, bandwidth=None)
+    recorded = asyncio.run(download(RecordingTransport(synthetic, cassette), "a.mp4"))
+    entries = [json.loads(line) for line in (cassette / "index.jsonl").read_text().splitlines()]
+    assert [(e["url"], e["status"]) for e in entries] == [(URL, 200)]
+
+    replayed = asyncio.run(download(ReplayTransport(cassette, latency=0, bandwidth=None), "b.mp4"))
+    assert replayed.size == SIZE
+    assert replayed.sha256 == recorded.sha256